@@ -1,20 +1,86 @@
+import concurrent.futures
+import os
+import threading
+
 from PIL import Image
 
 
 class AssetManager:
-    def __init__(self):
-        self._logo = Image.open("assets/logo.png")
-        self._metal_iris = Image.open("assets/metal/iris.png")
-        self._aluminum = Image.open("assets/metal/aluminum.png")
+    """
+    Registry of the images in the assets directory
+
+    Images are decoded on first use, and only once. preload() decodes them
+    on a few background threads, using an image that is still being
+    decoded waits for it.
+    """
+
+    def __init__(self, root="assets"):
+        self.root = root
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def _load(self, name) -> Image.Image:
+        image = Image.open(os.path.join(self.root, name))
+        image.load()
+        return image
+
+    def get(self, name) -> Image.Image:
+        """
+        Get a decoded image by its path in the assets directory
+        """
+        with self._lock:
+            future = self._images.get(name)
+            loading = future is None
+            if loading:
+                future = concurrent.futures.Future()
+                self._images[name] = future
+
+        if loading:
+            try:
+                future.set_result(self._load(name))
+            except Exception as error:  # handed to everyone waiting on it
+                future.set_exception(error)
+        return future.result()
+
+    def names(self):
+        """
+        Every image in the assets directory
+        """
+        return sorted(
+            os.path.relpath(os.path.join(directory, file), self.root)
+            for directory, _, files in os.walk(self.root)
+            for file in files
+            if file.endswith(".png")
+        )
+
+    def preload(self, names=None, workers=4):
+        """
+        Start decoding images in the background, all of them by default
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix="assets"
+        )
+        with self._lock:
+            for name in self.names() if names is None else names:
+                if name not in self._images:
+                    self._images[name] = executor.submit(self._load, name)
+        executor.shutdown(wait=False)
 
     @property
     def logo(self) -> Image.Image:
-        return self._logo
+        return self.get("logo.png")
 
     @property
     def iris(self) -> Image.Image:
-        return self._metal_iris
+        return self.get(os.path.join("metal", "iris.png"))
 
     @property
     def aluminum(self) -> Image.Image:
-        return self._aluminum
+        return self.get(os.path.join("metal", "aluminum.png"))
+
+    def neon(self, style) -> Image.Image:
+        return self.get(os.path.join("neon", style))
+
+
+# Shared by everything that uses assets, so each image is only decoded once
+registry = AssetManager()
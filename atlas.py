@@ -0,0 +1,268 @@
+"""
+Sprite atlas for Kevinbot v3 Eyes
+Author: Kevin Ahr
+
+Skin sprites, pre-resized, pre-tinted and stored in RGB565 with their
+alpha masks, saved to disk and memory mapped on start.
+The atlas is keyed by a hash of the skin options and assets it was built
+from, and rebuilt when they change.
+
+File layout:
+    MAGIC, VERSION and the header length (little-endian uint32s)
+    JSON header with the key and the offset and size of every sprite
+    For every sprite, its big-endian RGB565 pixels then its alpha mask
+Blocks are aligned to 16 bytes.
+
+Build ahead of time with: python atlas.py
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+from assets import registry as assets
+import display
+import skins
+import utils
+
+MAGIC = b"KBEYEATL"
+VERSION = 1
+PREAMBLE = struct.Struct("<8sII")
+
+# Skin options the atlas sprites depend on
+ATLAS_OPTIONS = {
+    "metal": ("iris_size", "tint"),
+    "neon": ("iris_size", "style", "fg_color_start", "fg_color_end"),
+}
+
+# Positions sampled along the neon gradient, every distinct color is stored
+GRADIENT_STEPS = 1024
+
+
+def align(size):
+    return size + (-size % 16)
+
+
+def sprite_name(key):
+    """
+    Name of a sprite cache key in the atlas
+    """
+    return "/".join(str(part) for part in key)
+
+
+def atlas_options(skin_settings):
+    """
+    The options the atlas depends on, out of the skins section of settings
+    """
+    return {
+        skin: {option: skin_settings[skin][option] for option in options}
+        for skin, options in ATLAS_OPTIONS.items()
+    }
+
+
+def atlas_assets(options):
+    """
+    Asset images the atlas is built from
+    """
+    return (
+        os.path.join("metal", "iris.png"),
+        os.path.join("neon", options["neon"]["style"]),
+    )
+
+
+def atlas_key(skin_settings):
+    """
+    Hash of the options and assets an atlas is built from
+    """
+    options = atlas_options(skin_settings)
+
+    digest = hashlib.sha256(f"{VERSION}".encode())
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    for name in atlas_assets(options):
+        with open(os.path.join(assets.root, name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def neon_gradient(start, end, steps=GRADIENT_STEPS):
+    """
+    Every distinct color of a neon gradient, in order
+    """
+    colors = utils.blend_colors(start, end, np.linspace(0, 1, steps).tolist())
+    return list(dict.fromkeys(colors))
+
+
+def atlas_sprites(skin_settings):
+    """
+    Yield (sprite cache key, Sprite565) for everything in the atlas
+    """
+    metal = skin_settings["metal"]
+    iris, shifted_iris = skins.metal_iris(metal["iris_size"], metal["tint"])
+    yield (
+        ("metal", "iris.rgb565", metal["iris_size"], metal["tint"]),
+        display.Sprite565(shifted_iris, iris),
+    )
+
+    # Recolored straight from the base sprite, so the sprite cache isn't
+    # flooded with gradient colors
+    neon = skin_settings["neon"]
+    iris = skins.neon_iris(neon["style"], neon["iris_size"])
+    for color in neon_gradient(neon["fg_color_start"], neon["fg_color_end"]):
+        yield (
+            ("neon", f"{neon['style']}.rgb565", neon["iris_size"], color),
+            display.Sprite565(utils.color_shift(iris, color)),
+        )
+
+
+class SpriteAtlas:
+    """
+    Memory mapped atlas of pre-rendered skin sprites
+
+    Sprites are looked up by their sprite cache key, their pixels and
+    masks are used straight from the mapped file.
+    """
+
+    def __init__(self, path="sprites.atlas"):
+        self.path = path
+        self.key = None
+        self.builds = 0
+
+        # (index, buffer, start) of the mapped atlas, replaced as a whole
+        self._mapped = ({}, None, 0)
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._again = False
+
+    def open(self, key=None):
+        """
+        Map the atlas file, only if it was built for key when one is given
+        Returns True if the atlas could be used
+        """
+        try:
+            with open(self.path, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, length = PREAMBLE.unpack_from(buffer)
+            if magic != MAGIC or version != VERSION:
+                return False
+            header = json.loads(buffer[PREAMBLE.size : PREAMBLE.size + length])
+        except (OSError, ValueError, struct.error):
+            return False
+
+        if key is not None and header["key"] != key:
+            return False
+
+        # A single assignment, lookups on other threads see either atlas
+        # Arrays from the old map keep it alive until they are gone
+        self._mapped = (header["sprites"], buffer, align(PREAMBLE.size + length))
+        self.key = header["key"]
+        return True
+
+    def get(self, key) -> display.Sprite565:
+        """
+        Get a sprite by its sprite cache key, None if the atlas doesn't have it
+        """
+        index, buffer, start = self._mapped
+        entry = index.get(sprite_name(key))
+        if entry is None:
+            return None
+
+        width, height, offset = entry["width"], entry["height"], entry["offset"]
+        offset += start
+        data = np.frombuffer(buffer, ">u2", width * height, offset)
+        alpha = np.frombuffer(
+            buffer, np.uint8, width * height, offset + align(width * height * 2)
+        )
+        return display.Sprite565.from_arrays(
+            data.reshape(height, width), alpha.reshape(height, width)
+        )
+
+    def build(self, skin_settings, key=None):
+        """
+        Render every sprite, save the atlas and map it
+        """
+        if key is None:
+            key = atlas_key(skin_settings)
+
+        sprites = {}
+        blocks = []
+        offset = 0
+        for sprite_key, sprite in atlas_sprites(skin_settings):
+            sprites[sprite_name(sprite_key)] = {
+                "width": sprite.width,
+                "height": sprite.height,
+                "offset": offset,
+            }
+            for block in (
+                sprite.data.astype(">u2").tobytes(),
+                sprite.alpha.astype(np.uint8).tobytes(),
+            ):
+                blocks.append(block + bytes(-len(block) % 16))
+                offset += align(len(block))
+
+        header = json.dumps({"key": key, "sprites": sprites}).encode()
+        preamble = PREAMBLE.pack(MAGIC, VERSION, len(header)) + header
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(preamble + bytes(-len(preamble) % 16))
+            file.writelines(blocks)
+        os.replace(temp_path, self.path)
+
+        self.builds += 1
+        self.open(key)
+        logging.info("Built sprite atlas with %s sprites", len(sprites))
+
+    def refresh(self, settings):
+        """
+        Make sure the atlas matches the current skin settings,
+        mapping the saved atlas or rebuilding it
+        """
+        skin_settings = json.loads(json.dumps(settings["skins"]))
+        key = atlas_key(skin_settings)
+        if key == self.key or self.open(key):
+            return
+        self.build(skin_settings, key)
+
+    def refresh_in_background(self, settings):
+        """
+        Refresh on a background thread, sprites are rendered on demand until it's done
+        """
+        with self._lock:
+            if self._refreshing:
+                self._again = True
+                return
+            self._refreshing = True
+
+        threading.Thread(
+            target=self._refresh_loop, args=(settings,), daemon=True
+        ).start()
+
+    def _refresh_loop(self, settings):
+        while True:
+            try:
+                self.refresh(settings)
+            except (OSError, ValueError):
+                logging.exception("Failed to build sprite atlas")
+
+            # settings changed again while refreshing
+            with self._lock:
+                if not self._again:
+                    self._refreshing = False
+                    return
+                self._again = False
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with open("settings.json", "r", encoding="UTF-8") as f:
+        settings = json.load(f)
+
+    atlas = SpriteAtlas(settings["atlas"]["path"])
+    atlas.build(settings["skins"])
+    print(f"Saved {atlas.path} ({os.path.getsize(atlas.path) // 1024} KiB)")
@@ -0,0 +1,260 @@
+"""
+Hardware backends for Kevinbot v3 Eyes
+Author: Kevin Ahr
+
+Hardware libraries are only imported when their backend is selected,
+so the eyes can run on any Linux machine with the framebuffer, null and
+pty/loopback backends.
+"""
+
+import fcntl
+import logging
+import os
+import struct
+import termios
+import tty
+
+import numpy as np
+from PIL import Image
+
+
+class FramebufferDisplay:
+    """
+    In-memory stand-in for an ST7789 panel
+
+    Keeps the panel's RGB565 memory and can dump every update as a PNG
+    or raw RGB565 file
+    """
+
+    def __init__(self, width=240, height=240, rotation=0, dump=None, dump_format="png"):
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        self.memory = np.zeros((height, width), dtype=">u2")
+
+        self.dump = dump
+        self.dump_format = dump_format
+        self.writes = 0
+        self.bytes_written = 0
+
+        if self.dump:
+            os.makedirs(self.dump, exist_ok=True)
+
+    def _block(self, x0, y0, x1, y1, data=None):
+        """
+        Write a window of RGB565 data, same as the adafruit driver
+        """
+        if data is None:
+            return self.memory[y0 : y1 + 1, x0 : x1 + 1].tobytes()
+
+        self.memory[y0 : y1 + 1, x0 : x1 + 1] = np.frombuffer(
+            data, dtype=">u2"
+        ).reshape(y1 - y0 + 1, x1 - x0 + 1)
+        self.writes += 1
+        self.bytes_written += len(data)
+
+        if self.dump:
+            self.save(
+                os.path.join(self.dump, f"frame_{self.writes:06d}.{self.dump_format}")
+            )
+        return None
+
+    def image(self) -> Image.Image:
+        """
+        Current panel contents as an RGB image, the way it is mounted
+        """
+        color = self.memory.astype(np.uint16)
+        rgb = np.dstack(
+            (
+                (color >> 8) & 0xF8,
+                (color >> 3) & 0xFC,
+                (color << 3) & 0xF8,
+            )
+        ).astype(np.uint8)
+        return Image.fromarray(np.rot90(rgb, -self.rotation // 90))
+
+    def save(self, path):
+        """
+        Save the panel contents as a PNG or raw RGB565 file
+        """
+        if path.endswith(".raw"):
+            with open(path, "wb") as file:
+                file.write(self.memory.tobytes())
+        else:
+            self.image().save(path)
+
+
+class NullBacklight:
+    """
+    Backlight that does nothing
+    """
+
+    def __init__(self):
+        self.value = 0
+
+
+class PtySerial:
+    """
+    Pseudo terminal standing in for the UART
+
+    Open the logged port with any serial terminal to talk to the eyes
+    without a core attached. Like a UART nobody listens to, data that
+    doesn't fit in the pty buffer is dropped.
+    """
+
+    def __init__(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self.dropped = 0
+        logging.warning("Serial stand-in available at %s", self.port)
+
+    def fileno(self):
+        return self._master
+
+    @property
+    def in_waiting(self):
+        data = fcntl.ioctl(self._master, termios.FIONREAD, b"\0\0\0\0")
+        return struct.unpack("I", data)[0]
+
+    def read(self, size=1):
+        try:
+            return os.read(self._master, size)
+        except BlockingIOError:
+            return b""
+
+    def write(self, data):
+        try:
+            written = os.write(self._master, data)
+        except OSError:  # includes BlockingIOError, the buffer is full
+            written = 0
+
+        if written < len(data):
+            if not self.dropped:
+                logging.warning("Serial stand-in isn't read, dropping output")
+            self.dropped += len(data) - written
+        return written
+
+
+class LoopbackSerial:
+    """
+    In-process serial port
+
+    Commands are fed in with inject(), everything the eyes send is kept
+    in written
+    """
+
+    def __init__(self):
+        self._read, self._write = os.pipe()
+        os.set_blocking(self._read, False)
+        self.written = bytearray()
+
+    def fileno(self):
+        return self._read
+
+    @property
+    def in_waiting(self):
+        data = fcntl.ioctl(self._read, termios.FIONREAD, b"\0\0\0\0")
+        return struct.unpack("I", data)[0]
+
+    def inject(self, data: bytes):
+        """
+        Send data to the eyes, as if it came from the core
+        """
+        os.write(self._write, data)
+
+    def read(self, size=1):
+        try:
+            return os.read(self._read, size)
+        except BlockingIOError:
+            return b""
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+
+def open_serial(settings: dict):
+    """
+    Open the serial backend, reads never block
+    """
+    backend = settings["backends"]["serial"]
+    if backend == "pty":
+        return PtySerial()
+    if backend == "loopback":
+        return LoopbackSerial()
+
+    import serial
+
+    return serial.Serial(
+        settings["comms"]["port"], settings["comms"]["baud"], timeout=0
+    )
+
+
+def open_displays(settings: dict):
+    """
+    Open both display backends
+    """
+    if settings["backends"]["display"] == "framebuffer":
+        dump = settings["backends"]["frame_dump"]
+        return tuple(
+            FramebufferDisplay(
+                240,
+                240,
+                rotation=180,
+                dump=os.path.join(dump, f"display_{index}") if dump else None,
+                dump_format=settings["backends"]["frame_dump_format"],
+            )
+            for index in range(2)
+        )
+
+    import board
+    import busio
+    import digitalio
+    from adafruit_rgb_display import st7789
+
+    spi_0 = busio.SPI(clock=board.SCK, MOSI=board.MOSI)
+    spi_1 = busio.SPI(clock=board.SCK_1, MOSI=board.MOSI_1)
+
+    # Init ST7789 displays
+    display_0 = st7789.ST7789(
+        spi_0,
+        height=240,
+        y_offset=80,
+        rotation=180,
+        cs=digitalio.DigitalInOut(board.CE0),
+        dc=digitalio.DigitalInOut(board.D25),
+        rst=digitalio.DigitalInOut(board.D24),
+        baudrate=settings["display"]["speed"],
+    )
+
+    display_1 = st7789.ST7789(
+        spi_1,
+        height=240,
+        y_offset=80,
+        rotation=180,
+        cs=digitalio.DigitalInOut(board.CE1),
+        dc=digitalio.DigitalInOut(board.D23),
+        rst=digitalio.DigitalInOut(board.D22),
+        baudrate=settings["display"]["speed"],
+    )
+
+    return display_0, display_1
+
+
+def open_backlight(settings: dict):
+    """
+    Open the backlight backend
+    """
+    if settings["backends"]["backlight"] == "null":
+        return NullBacklight()
+
+    from gpiozero import PWMLED, Device
+    from gpiozero.pins.rpigpio import RPiGPIOFactory
+
+    # Change the default pin factory for gpiozero
+    # Since there are some issues with the default lgpio factory, I am switching back to the RPi.GPIO factory
+    Device.pin_factory = RPiGPIOFactory()
+
+    return PWMLED(settings["display"]["backlight_pin"])
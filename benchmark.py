@@ -0,0 +1,355 @@
+"""
+Benchmarks for Kevinbot v3 Eyes
+Author: Kevin Ahr
+
+Run from the repository root:
+    python benchmark.py colors
+    python benchmark.py render [--frames 300] [--json results.json]
+
+Without a command, both are run with the default options
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import PIL
+from PIL import Image, ImageColor
+
+import main
+import motion
+import skins
+import utils
+
+
+def reference_shift_hue(image, hue):
+    """
+    Original per-pixel implementation of utils.shift_hue
+    """
+    image_hue_shifted = image.convert("HSV")
+    pixels = image_hue_shifted.load()
+    width, height = image_hue_shifted.size
+    for x in range(width):
+        for y in range(height):
+            h, s, v = pixels[x, y]
+            pixels[x, y] = ((h + hue) % 256, s, v)
+
+    return image_hue_shifted.convert("RGB")
+
+
+def reference_color_shift(image, hex_color):
+    """
+    Original per-pixel implementation of utils.color_shift
+    """
+    red, green, blue = ImageColor.getrgb(hex_color)
+
+    image = image.copy()
+    pixels = image.load()
+    width, height = image.size
+    for x in range(width):
+        for y in range(height):
+            _, _, _, alpha = pixels[x, y]
+            pixels[x, y] = (red, green, blue, alpha)
+
+    return image
+
+
+def reference_blend_colors(color1, color2, weight):
+    """
+    Original scalar implementation of utils.blend_colors
+    """
+    rgb1 = tuple(int(color1.strip("#")[i : i + 2], 16) for i in (0, 2, 4))
+    rgb2 = tuple(int(color2.strip("#")[i : i + 2], 16) for i in (0, 2, 4))
+
+    blended_rgb = tuple(
+        int((1 - weight) * c1 + weight * c2) for c1, c2 in zip(rgb1, rgb2)
+    )
+    return "#{:02x}{:02x}{:02x}".format(*blended_rgb)
+
+
+def timed(function, *args, iterations=10):
+    """
+    Average run time of a function in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(*args)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def color_benchmark():
+    """
+    Compare the original and vectorized color functions on the shipped assets
+    """
+    iris = Image.open(os.path.join("assets", "metal", "iris.png")).resize((200, 200))
+    neon = (
+        Image.open(os.path.join("assets", "neon", "neon1.png"))
+        .convert("RGBA")
+        .resize((100, 100))
+    )
+    weights = [i / 255 for i in range(256)]
+
+    results = {
+        "shift_hue": (
+            timed(reference_shift_hue, iris, 171),
+            timed(utils.shift_hue, iris, 171),
+        ),
+        "color_shift": (
+            timed(reference_color_shift, neon, "#00ff00"),
+            timed(utils.color_shift, neon, "#00ff00"),
+        ),
+        "blend_colors (256 steps)": (
+            timed(
+                lambda: [
+                    reference_blend_colors("#0000FF", "#00FF00", weight)
+                    for weight in weights
+                ]
+            ),
+            timed(utils.blend_colors, "#0000FF", "#00FF00", weights),
+        ),
+    }
+
+    for name, (old, new) in results.items():
+        print(f"{name:26} {old:9.3f}ms -> {new:7.3f}ms  ({old / new:.1f}x)")
+
+
+# Iris sizes swept for each skin, the middle one is the default
+IRIS_SIZES = {
+    "simple": (60, 105, 150),
+    "metal": (120, 200, 240),
+    "neon": (60, 100, 160),
+}
+
+# Rate motion is simulated at, so a run covers the same motion no matter
+# how fast frames are rendered
+SIMULATED_FPS = 45
+
+
+class SimulatedClock:
+    """
+    Clock for MotionClock that advances one frame at a time
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def headless_eyes(directory):
+    """
+    RobotEyes on the framebuffer, null and loopback backends
+
+    Settings are copied into directory, so the benchmark never touches
+    settings.json. SPI writes are done inline, so push time includes them.
+    """
+    with open("settings.json", "r", encoding="UTF-8") as file:
+        settings = json.load(file)
+
+    settings["backends"].update(
+        display="framebuffer", backlight="null", serial="loopback", frame_dump=""
+    )
+    settings["display"]["threaded_output"] = False
+    settings["atlas"]["path"] = os.path.join(directory, "sprites.atlas")
+    settings["render_worker"]["enabled"] = False
+
+    path = os.path.join(directory, "settings.json")
+    with open(path, "w", encoding="UTF-8") as file:
+        json.dump(settings, file, indent=2)
+
+    return main.RobotEyes(path)
+
+
+def render_cases(eyes):
+    """
+    Yield (result fields, setup) for every screen and skin configuration
+    """
+
+    def screen(state, page=None):
+        def setup():
+            eyes.state = state
+            if page is not None:
+                # set_state doesn't allow the tv static page
+                eyes.visual_page = page
+            eyes.set_error(1)
+
+        return setup
+
+    yield {"case": "logo"}, screen(main.State.LOGO)
+    yield {"case": "loading"}, screen(main.State.WAIT)
+    yield {"case": "error"}, screen(main.State.ERORR)
+    yield {"case": "tv_static"}, screen(
+        main.State.HOME, main.VisualPage.STATE_TV_STATIC
+    )
+
+    pages = {
+        "simple": main.VisualPage.STATE_EYE_SIMPLE,
+        "metal": main.VisualPage.STATE_EYE_METAL,
+        "neon": main.VisualPage.STATE_EYE_NEON,
+    }
+    for skin, sizes in IRIS_SIZES.items():
+        for iris_size in sizes:
+            for mode in main.Motions:
+
+                def setup(skin=skin, iris_size=iris_size, mode=mode):
+                    eyes.state = main.State.HOME
+                    eyes.set_state(pages[skin])
+                    eyes.set_skin_option(skin, "iris_size", iris_size)
+                    if skin == "simple":
+                        # keep the pupil in proportion to the iris
+                        eyes.set_skin_option(skin, "pupil_size", iris_size * 86 // 105)
+                    eyes.set_motion(mode)
+
+                yield {
+                    "case": skin,
+                    "iris_size": iris_size,
+                    "motion": mode.name.lower(),
+                }, setup
+
+
+def render_benchmark(frames=300):
+    """
+    Time every screen and skin, returns a list of results
+
+    Each frame is rendered and pushed to the framebuffer displays, even
+    when nothing changed, so every frame is timed. Frame times, bytes sent
+    to both displays and the peak memory allocated while producing a frame
+    are recorded, and separately how many frames the display loop would
+    skip because they match what the panels show.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        eyes = headless_eyes(directory)
+        displays = (eyes.display_0, eyes.display_1)
+        original_skins = json.loads(json.dumps(eyes.settings["skins"]))
+
+        for fields, setup in render_cases(eyes):
+            clock = SimulatedClock()
+
+            def frame():
+                clock.now += 1 / SIMULATED_FPS
+                # stay on the logo, it is normally replaced after logo_time
+                eyes.start_time = time.time()
+                for push in eyes.render_frame():
+                    eyes.output.push(*push)
+
+            # skip pass, count frames that wouldn't be rendered at all
+            setup()
+            eyes.motion_clock = motion.MotionClock(clock)
+            eyes.output.skip_unchanged = True
+            skipped = 0
+            for _ in range(frames):
+                sent = eyes.output.sent
+                frame()
+                skipped += eyes.output.sent == sent
+
+            # timing pass
+            setup()
+            eyes.motion_clock = motion.MotionClock(clock)
+            eyes.output.skip_unchanged = False
+            written = sum(disp.bytes_written for disp in displays)
+            times = []
+            for _ in range(frames):
+                start = time.perf_counter()
+                frame()
+                times.append((time.perf_counter() - start) * 1000)
+            written = sum(disp.bytes_written for disp in displays) - written
+
+            # allocation pass, run separately since tracing slows everything down
+            setup()
+            eyes.motion_clock = motion.MotionClock(clock)
+            allocated = []
+            tracemalloc.start()
+            for _ in range(min(frames, 60)):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                frame()
+                allocated.append(tracemalloc.get_traced_memory()[1] - before)
+            tracemalloc.stop()
+
+            percentiles = statistics.quantiles(times, n=100, method="inclusive")
+            results.append(
+                {
+                    **fields,
+                    "frames": frames,
+                    "skipped": skipped,
+                    "fps": round(1000 / statistics.fmean(times), 1),
+                    "first_ms": round(times[0], 3),
+                    "p50_ms": round(percentiles[49], 3),
+                    "p99_ms": round(percentiles[98], 3),
+                    "bytes_per_frame": round(written / frames),
+                    "alloc_bytes_per_frame": round(statistics.median(allocated)),
+                }
+            )
+
+            # put skin options back for the next case
+            for skin, options in original_skins.items():
+                eyes.settings["skins"][skin].update(options)
+                skins.invalidate_sprites(skin)
+
+        eyes.settings_writer.stop()
+
+    return results
+
+
+def print_render_results(results):
+    """
+    Print render benchmark results as a table
+    """
+    print(
+        f"{'case':10} {'iris':>5} {'motion':11} {'fps':>8} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'bytes':>8} {'alloc':>8} {'skipped':>8}"
+    )
+    for result in results:
+        print(
+            f"{result['case']:10} {result.get('iris_size', ''):>5} "
+            f"{result.get('motion', ''):11} {result['fps']:8.1f} "
+            f"{result['p50_ms']:8.3f} {result['p99_ms']:8.3f} "
+            f"{result['bytes_per_frame']:8} {result['alloc_bytes_per_frame']:8} "
+            f"{result['skipped']:8}"
+        )
+
+
+def save_render_results(results, path):
+    """
+    Save render benchmark results as JSON, along with the environment
+    """
+    with open(path, "w", encoding="UTF-8") as file:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "numpy": np.__version__,
+                "pillow": PIL.__version__,
+                "simulated_fps": SIMULATED_FPS,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("command", nargs="?", choices=("colors", "render"))
+    parser.add_argument(
+        "--frames", type=int, default=300, help="frames rendered per case"
+    )
+    parser.add_argument("--json", help="save render results to this file")
+    args = parser.parse_args()
+
+    if args.command in (None, "colors"):
+        color_benchmark()
+
+    if args.command in (None, "render"):
+        render_results = render_benchmark(args.frames)
+        print_render_results(render_results)
+        if args.json:
+            save_render_results(render_results, args.json)
@@ -0,0 +1,295 @@
+"""
+Serial commands for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import logging
+import struct
+import time
+
+# Marks the start of a binary frame, this byte never appears in UTF-8 text
+BINARY_START = b"\xff"
+
+
+def integer(minimum=None, maximum=None):
+    """
+    Argument type for an integer, optionally limited to a range
+    """
+
+    def convert(value):
+        value = int(value)
+        if (minimum is not None and value < minimum) or (
+            maximum is not None and value > maximum
+        ):
+            raise ValueError(f"{value} is out of range")
+        return value
+
+    return convert
+
+
+def text(value):
+    """
+    Argument type for plain text
+    """
+    return str(value)
+
+
+def option_value(value):
+    """
+    Argument type for skin options, digits are converted to an int
+    """
+    if value.isdigit():
+        return int(value)
+    return value
+
+
+class Command:
+    """
+    A serial command with its handler and argument types
+    """
+
+    def __init__(
+        self,
+        name,
+        handler,
+        args=(),
+        separator=",",
+        required=None,
+        opcode=None,
+        binary_format="",
+        coalesce=None,
+        immediate=False,
+    ):
+        self.name = name
+        self.handler = handler
+        self.args = args
+        self.separator = separator
+        self.required = len(args) if required is None else required
+        self.opcode = opcode
+        self.binary = struct.Struct(f">{binary_format}")
+        # Number of leading arguments that identify what an idempotent command
+        # sets, None for commands that have to run in order
+        self.coalesce = coalesce
+        # Run as soon as it's parsed, for commands that change how the
+        # bytes after them are read
+        self.immediate = immediate
+
+
+class CommandRegistry:
+    """
+    Table of serial commands
+
+    Text commands look like name=arg1,arg2 and end with a newline.
+    Commands with an opcode can also be sent as binary frames once binary
+    mode is enabled: BINARY_START, the opcode, then the packed arguments.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.opcodes = {}
+
+    def register(self, name, handler, args=(), **kwargs):
+        """
+        Add a command
+        """
+        command = Command(name, handler, args, **kwargs)
+        self.commands[name] = command
+        if command.opcode is not None:
+            self.opcodes[command.opcode] = command
+
+    def binary_size(self, opcode):
+        """
+        Payload size of a binary command, None if the opcode is unknown
+        """
+        if opcode not in self.opcodes:
+            return None
+        return self.opcodes[opcode].binary.size
+
+    def parse(self, line: str):
+        """
+        Parse a text command, returns (command, args) or None if it is invalid
+        """
+        name, _, data = line.strip("\r\n").partition("=")
+        command = self.commands.get(name)
+        if command is None:
+            logging.warning("Unknown command %s", name)
+            return None
+
+        values = []
+        if data and command.args:
+            values = data.split(command.separator, len(command.args) - 1)
+        return self.convert(command, values)
+
+    def parse_binary(self, opcode, payload: bytes):
+        """
+        Parse a binary command, returns (command, args) or None if it is invalid
+        """
+        command = self.opcodes.get(opcode)
+        if command is None:
+            logging.warning("Unknown binary command %s", opcode)
+            return None
+        return self.convert(command, command.binary.unpack(payload))
+
+    def convert(self, command: Command, values):
+        """
+        Convert and validate arguments, returns (command, args) or None
+        """
+        if not command.required <= len(values) <= len(command.args):
+            logging.warning(
+                "Expected %s values for %s, got %s",
+                len(command.args),
+                command.name,
+                len(values),
+            )
+            return None
+
+        try:
+            args = [arg(value) for arg, value in zip(command.args, values)]
+        except ValueError as error:
+            logging.warning("Invalid value for %s: %s", command.name, error)
+            return None
+
+        return command, args
+
+
+class CommandQueue:
+    """
+    Commands waiting to be applied on the next frame
+
+    Idempotent commands only keep their latest arguments, in the place of
+    the first one, so a burst of setPosition costs one update per frame.
+    Ordered commands are kept as they are, and nothing is coalesced across
+    them, so everything keeps its order relative to them.
+    Immediate commands run everything queued before them, then themselves.
+    Errors from a handler are logged and don't stop the other commands.
+    Handling time of each command goes to stats, if given, and every
+    command is tagged as received on the latency tracer, if given.
+    """
+
+    def __init__(self, stats=None, tracer=None):
+        self.stats = stats
+        self.tracer = tracer
+        self.coalesced = 0
+
+        self._queue = []
+        self._latest = {}
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, command: Command, args):
+        """
+        Queue a parsed command
+        """
+        if self.tracer is not None:
+            self.tracer.received(command.name)
+
+        if command.immediate:
+            self.apply()
+            self.run(command, args)
+            return
+
+        if command.coalesce is None:
+            self._queue.append([command, args])
+            self._latest = {}
+            return
+
+        key = (command.name, *args[: command.coalesce])
+        entry = self._latest.get(key)
+        if entry is not None:
+            entry[1] = args
+            self.coalesced += 1
+            return
+
+        entry = [command, args]
+        self._queue.append(entry)
+        self._latest[key] = entry
+
+    def apply(self):
+        """
+        Run every queued command
+        """
+        queue, self._queue, self._latest = self._queue, [], {}
+        for command, args in queue:
+            self.run(command, args)
+
+    def run(self, command: Command, args):
+        """
+        Run a command, a failing handler is logged so it can't stop the display loop
+        """
+        start = time.perf_counter()
+        try:
+            command.handler(*args)
+        except Exception:  # any handler bug, the next frame still has to render
+            logging.exception("Command %s failed", command.name)
+        if self.stats is not None:
+            self.stats.record("command", start)
+
+
+class CommandStream:
+    """
+    Split received serial data into commands and run them
+
+    Data can arrive in any sized pieces, incomplete commands are kept
+    until the rest arrives. Parsed commands go to a queue, which is applied
+    once per frame.
+    """
+
+    def __init__(self, registry: CommandRegistry, queue: CommandQueue):
+        self.registry = registry
+        self.queue = queue
+        self.binary = False
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes):
+        """
+        Add received data
+        """
+        self._buffer += data
+
+    def messages(self):
+        """
+        Yield complete commands as (opcode, payload) for binary frames,
+        or (None, line) for text
+        """
+        while self._buffer:
+            if self.binary and self._buffer[:1] == BINARY_START:
+                if len(self._buffer) < 2:
+                    return
+                opcode = self._buffer[1]
+                size = self.registry.binary_size(opcode)
+                if size is None:
+                    logging.warning("Unknown binary command %s", opcode)
+                    del self._buffer[:2]
+                    continue
+                if len(self._buffer) < 2 + size:
+                    return
+                payload = bytes(self._buffer[2 : 2 + size])
+                del self._buffer[: 2 + size]
+                yield opcode, payload
+            else:
+                end = self._buffer.find(b"\n")
+                if end < 0:
+                    return
+                line = bytes(self._buffer[: end + 1])
+                del self._buffer[: end + 1]
+                yield None, line
+
+    def process(self):
+        """
+        Parse every complete command and queue it
+        """
+        for opcode, data in self.messages():
+            if opcode is not None:
+                parsed = self.registry.parse_binary(opcode, data)
+            else:
+                try:
+                    line = data.decode("UTF-8")
+                except UnicodeDecodeError:
+                    logging.warning("Could not decode serial data")
+                    continue
+                logging.debug("Received %s", line.strip())
+                parsed = self.registry.parse(line)
+
+            if parsed is not None:
+                self.queue.put(*parsed)
@@ -0,0 +1,82 @@
+"""
+Layered compositing for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import numpy as np
+from PIL import Image
+
+import display
+
+
+class LayeredSkin:
+    """
+    A skin made of static and dynamic layers
+
+    Static layers (backgrounds, textures) are drawn once into a base frame,
+    which is cached until one of the options they use changes.
+    Every frame, the dynamic layers (iris, pupil) are drawn onto a copy of
+    the base, each returning the box it drew in.
+
+    Static layers are called as layer(image, settings, size), dynamic ones
+    as layer(frame, settings, pos). Skins with native layers can also be
+    composited as RGB565 arrays, on an RGB565 copy of the base.
+    """
+
+    def __init__(self, name, cache, static=(), dynamic=(), native=None, options=()):
+        self.name = name
+        self.cache = cache
+        self.static = static
+        self.dynamic = dynamic
+        self.native = native
+        self.options = options
+
+    def base_key(self, settings, size, asset):
+        """
+        Cache key of the base, changes with every option the static layers use
+        """
+        return (
+            self.name,
+            asset,
+            tuple(size),
+            tuple(settings["skins"][self.name][option] for option in self.options),
+        )
+
+    def base(self, settings, size) -> Image.Image:
+        """
+        Static layers drawn into a single image
+        """
+
+        def create():
+            image = Image.new("RGB", (size[0], size[1]))
+            for layer in self.static:
+                layer(image, settings, size)
+            return image
+
+        return self.cache.get(self.base_key(settings, size, "base"), create)
+
+    def base565(self, settings, size) -> np.ndarray:
+        """
+        Static layers pre-converted to RGB565
+        """
+        return self.cache.get(
+            self.base_key(settings, size, "base.rgb565"),
+            lambda: display.rgb565(np.asarray(self.base(settings, size))),
+        )
+
+    def __call__(self, settings, pos=(120, 120), size=(240, 240), native=False):
+        """
+        Composite a frame, returns the frame and the box the dynamic layers drew in
+        """
+        if native and self.native is not None:
+            frame = self.base565(settings, size).copy()
+            layers = self.native
+        else:
+            frame = self.base(settings, size).copy()
+            layers = self.dynamic
+
+        box = None
+        for layer in layers:
+            layer_box = layer(frame, settings, pos)
+            box = layer_box if box is None else display.union_box(box, layer_box)
+        return frame, box
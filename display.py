@@ -0,0 +1,493 @@
+"""
+Display output for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import functools
+import logging
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def rgb565(rgb, out=None):
+    """
+    Convert an RGB array to big-endian RGB565, the panel's pixel format
+    """
+    if out is None:
+        out = np.empty(rgb.shape[:2], dtype=">u2")
+
+    color = rgb[..., 0].astype(np.uint16)
+    color &= 0xF8
+    color <<= 8
+
+    channel = rgb[..., 1].astype(np.uint16)
+    channel &= 0xFC
+    channel <<= 3
+    color |= channel
+
+    channel = rgb[..., 2].astype(np.uint16)
+    channel >>= 3
+    color |= channel
+
+    out[...] = color
+    return out
+
+
+def blend565(background, foreground, alpha):
+    """
+    Alpha blend RGB565 pixels, without going back to 24-bit color
+    """
+    background = background.astype(np.uint32)
+    foreground = foreground.astype(np.uint32)
+    inverse = 255 - alpha
+
+    red = ((foreground >> 11) * alpha + (background >> 11) * inverse + 127) // 255
+    green = (
+        ((foreground >> 5) & 0x3F) * alpha + ((background >> 5) & 0x3F) * inverse + 127
+    ) // 255
+    blue = ((foreground & 0x1F) * alpha + (background & 0x1F) * inverse + 127) // 255
+
+    return (red << 11) | (green << 5) | blue
+
+
+class Sprite565:
+    """
+    Sprite stored in RGB565 with its alpha mask
+
+    Fully opaque pixels are copied, partially transparent edge pixels are
+    blended in RGB565
+    """
+
+    def __init__(self, image: Image.Image, mask: Image.Image = None):
+        rgba = np.asarray(image.convert("RGBA"))
+        if mask is None:
+            alpha = rgba[..., 3]
+        else:
+            alpha = np.asarray(mask.convert("RGBA"))[..., 3]
+
+        self._setup(rgb565(rgba[..., :3]), alpha)
+
+    @classmethod
+    def from_arrays(cls, data, alpha):
+        """
+        Sprite from RGB565 pixels and an alpha mask, like the ones in a sprite atlas
+        """
+        sprite = cls.__new__(cls)
+        sprite._setup(data, alpha)
+        return sprite
+
+    def _setup(self, data, alpha):
+        self.height, self.width = alpha.shape
+        self.data = data
+        self.alpha = alpha
+        self.opaque = alpha == 255
+
+        edge = (alpha > 0) & (alpha < 255)
+        self.edge = np.nonzero(edge)
+        self.edge_data = self.data[edge]
+        self.edge_alpha = alpha[edge].astype(np.uint32)
+
+
+def blit565(frame, sprite: Sprite565, x, y):
+    """
+    Draw a sprite onto an RGB565 frame with its top left corner at x, y
+    """
+    height, width = frame.shape
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite.width, width), min(y + sprite.height, height)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    source = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+    np.copyto(frame[y0:y1, x0:x1], sprite.data[source], where=sprite.opaque[source])
+
+    edge_y, edge_x = sprite.edge
+    edge_y, edge_x = edge_y + y, edge_x + x
+    inside = (edge_x >= x0) & (edge_x < x1) & (edge_y >= y0) & (edge_y < y1)
+    edge_y, edge_x = edge_y[inside], edge_x[inside]
+    frame[edge_y, edge_x] = blend565(
+        frame[edge_y, edge_x], sprite.edge_data[inside], sprite.edge_alpha[inside]
+    )
+
+
+def union_box(box_a, box_b):
+    """
+    Smallest box containing both boxes
+    """
+    return (
+        min(box_a[0], box_b[0]),
+        min(box_a[1], box_b[1]),
+        max(box_a[2], box_b[2]),
+        max(box_a[3], box_b[3]),
+    )
+
+
+def clip_box(box, size):
+    """
+    Clip a box to the panel, returns None if nothing is left
+    """
+    x0, y0 = max(box[0], 0), max(box[1], 0)
+    x1, y1 = min(box[2], size[0]), min(box[3], size[1])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+def panel_box(disp, box):
+    """
+    Panel coordinates of a window after the display's rotation is applied
+    """
+    x0, y0, x1, y1 = box
+    if disp.rotation == 90:
+        return y0, disp.height - x1, y1, disp.height - x0
+    if disp.rotation == 180:
+        return disp.width - x1, disp.height - y1, disp.width - x0, disp.height - y0
+    if disp.rotation == 270:
+        return disp.width - y1, x0, disp.width - y0, x1
+    return box
+
+
+class Frame:
+    """
+    A frame in panel format, shared by every panel
+    Goes back to its pool once every user released it,
+    frames without a pool are kept as they are (used for caching)
+    """
+
+    def __init__(self, pool, data):
+        self.data = data
+        self._pool = pool
+        self._users = 0
+
+    def retain(self):
+        if self._pool is None:
+            return
+        with self._pool.lock:
+            self._users += 1
+
+    def release(self):
+        if self._pool is None:
+            return
+        with self._pool.lock:
+            self._users -= 1
+            if self._users == 0:
+                self._pool.free.append(self)
+
+
+class FramePool:
+    """
+    Reusable RGB565 frame buffers
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.free = []
+        self.lock = threading.Lock()
+
+    def acquire(self) -> Frame:
+        """
+        Get a free frame, the caller holds the first reference
+        """
+        with self.lock:
+            frame = self.free.pop() if self.free else None
+
+        if frame is None:
+            frame = Frame(self, np.empty(self.shape, dtype=">u2"))
+        frame.retain()
+        return frame
+
+
+def to_panel(image, rotation, out):
+    """
+    Convert a PIL image or an RGB565 array to panel orientation and RGB565
+    """
+    if isinstance(image, np.ndarray):
+        out[...] = np.rot90(image, rotation // 90)
+        return out
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return rgb565(np.rot90(np.asarray(image), rotation // 90), out)
+
+
+def write_frame(disp, data, window=None):
+    """
+    Send an RGB565 frame to a panel, or only a window of it
+    """
+    if window is None:
+        x0, y0, x1, y1 = 0, 0, data.shape[1], data.shape[0]
+    else:
+        x0, y0, x1, y1 = panel_box(disp, window)
+        data = np.ascontiguousarray(data[y0:y1, x0:x1])
+
+    disp._block(x0, y0, x1 - 1, y1 - 1, memoryview(data.reshape(-1).view(np.uint8)))
+
+
+class DisplayWriter(threading.Thread):
+    """
+    Send frames to one panel from its own thread
+
+    Holds a single latest-frame slot next to the frame being sent, so the
+    next frame can be rendered while the current one is transferred.
+    Frames still waiting when a newer one arrives are dropped and counted.
+    on_sent is called as on_sent(sequence, write) after every write.
+    """
+
+    def __init__(self, disp, name="display", stats=None, on_sent=None):
+        super().__init__(daemon=True)
+        self.disp = disp
+        self.name = name
+        self.stats = stats
+        self.on_sent = on_sent
+        self.sent = 0
+        self.dropped = 0
+
+        self._pending = None
+        self._sending = False
+        self._condition = threading.Condition()
+
+    def submit(self, frame: Frame, window=None, sequence=0):
+        """
+        Queue a frame, replacing the one waiting to be sent
+        """
+        frame.retain()
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+                pending_frame, pending_window, _ = self._pending
+                pending_frame.release()
+                # The skipped window still has to reach the panel
+                if pending_window is None or window is None:
+                    window = None
+                else:
+                    window = union_box(pending_window, window)
+
+            self._pending = (frame, window, sequence)
+            self._condition.notify_all()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                frame, window, sequence = self._pending
+                self._pending = None
+                self._sending = True
+
+            start = time.perf_counter()
+            try:
+                write_frame(self.disp, frame.data, window)
+                if self.stats is not None:
+                    self.stats.record(f"push.{self.name}", start)
+            except (OSError, ValueError):
+                logging.exception("Failed to send frame to display")
+            frame.release()
+            self.sent += 1
+            if self.on_sent is not None:
+                self.on_sent(sequence, self.sent)
+
+            with self._condition:
+                self._sending = False
+                self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Wait until every queued frame was sent, returns False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._pending is None and not self._sending, timeout
+            )
+
+
+class PanelOutput:
+    """
+    Push frames to the panels
+
+    Frames are converted to RGB565 once and the same buffer is sent to
+    every panel, so all panels need the same size and rotation.
+    Frames can also go to only some of the panels, when the eyes differ.
+    With partial updates enabled, only the union of the previous and
+    current iris boxes is sent. Frames without a box are sent in full.
+    With threaded output, each panel is written by its own DisplayWriter.
+    Conversion and per panel write times go to stats, if given.
+
+    Every push that sends something gets the next sequence number.
+    on_sent, if set, is called as on_sent(index, sequence, write) once a
+    panel was written, write counts the writes to that panel.
+    """
+
+    def __init__(self, displays, size, partial=False, threaded=False, stats=None):
+        self.displays = displays
+        self.size = size
+        self.partial = partial
+        self.stats = stats
+
+        self.rotation = displays[0].rotation
+        self.pool = FramePool((displays[0].height, displays[0].width))
+
+        self.writers = []
+        if threaded:
+            self.writers = [
+                DisplayWriter(
+                    disp,
+                    f"display_{index}",
+                    stats,
+                    functools.partial(self._sent, index),
+                )
+                for index, disp in enumerate(displays)
+            ]
+            for writer in self.writers:
+                writer.start()
+
+        # Pushes that sent something to a panel
+        self.sent = 0
+        # Frames with the key of the frame on the panels aren't sent again,
+        # turned off by the benchmark to time every frame
+        self.skip_unchanged = True
+        self.on_sent = None
+        # Sequence of the last push to each panel, and writes without writers
+        self.submitted = [0] * len(displays)
+        self._written = [0] * len(displays)
+
+        # Tracked per panel, since panels can be sent different frames
+        self._previous_box = [None] * len(displays)
+        self._previous_key = [None] * len(displays)
+        self._full_update = [True] * len(displays)
+        self._lock = threading.Lock()
+
+    def _sent(self, index, sequence, write):
+        if self.on_sent is not None:
+            self.on_sent(index, sequence, write)
+
+    @property
+    def dropped(self):
+        """
+        Frames dropped by the writers because they fell behind
+        """
+        return sum(writer.dropped for writer in self.writers)
+
+    def invalidate(self):
+        """
+        Send the next frame in full
+        Used on skin, state or settings changes
+        """
+        with self._lock:
+            self._full_update = [True] * len(self.displays)
+
+    def is_current(self, key, panels=None):
+        """
+        Check if the panels already show the frame with this key,
+        so it doesn't have to be rendered at all
+        """
+        if key is None or not self.skip_unchanged:
+            return False
+        if panels is None:
+            panels = range(len(self.displays))
+
+        with self._lock:
+            return all(
+                self._previous_key[index] == key and not self._full_update[index]
+                for index in panels
+            )
+
+    def wait(self, timeout=None):
+        """
+        Wait until the writers sent every pushed frame, returns False on timeout
+        Pushes without writers are already done when push returns
+        """
+        return all(writer.wait(timeout) for writer in self.writers)
+
+    @property
+    def frame_bytes(self):
+        """
+        Size of one converted frame
+        """
+        return self.pool.shape[0] * self.pool.shape[1] * 2
+
+    def freeze(self, image) -> Frame:
+        """
+        Convert a frame into a buffer that is never reused, for caching
+        """
+        frame = self.convert(image)
+        frozen = Frame(None, frame.data.copy())
+        frame.release()
+        return frozen
+
+    def convert(self, image) -> Frame:
+        """
+        Convert a frame to panel orientation and RGB565
+        Takes a PIL image, an RGB565 array from the native skins,
+        or an already converted frame
+        """
+        if isinstance(image, Frame):
+            image.retain()
+            return image
+
+        frame = self.pool.acquire()
+        to_panel(image, self.rotation, frame.data)
+        return frame
+
+    def push(self, image, box=None, key=None, panels=None):
+        """
+        Send a frame to the panels, or only to the panel indexes in panels
+        Frames with the same key as the previous frame are not sent again
+        """
+        if panels is None:
+            panels = range(len(self.displays))
+
+        windows = []
+        with self._lock:
+            for index in panels:
+                if (
+                    key is not None
+                    and self.skip_unchanged
+                    and key == self._previous_key[index]
+                    and not self._full_update[index]
+                ):
+                    continue
+                self._previous_key[index] = key
+
+                full_update = (
+                    self._full_update[index]
+                    or not self.partial
+                    or box is None
+                    or self._previous_box[index] is None
+                )
+                previous_box = self._previous_box[index]
+                self._previous_box[index] = box
+                self._full_update[index] = False
+
+                if full_update:
+                    windows.append((index, None))
+                    continue
+
+                window = clip_box(union_box(previous_box, box), self.size)
+                if window is not None:
+                    windows.append((index, window))
+
+        if not windows:
+            return
+        self.sent += 1
+
+        start = time.perf_counter()
+        frame = self.convert(image)
+        if self.stats is not None:
+            self.stats.record("convert", start)
+
+        for index, window in windows:
+            self.submitted[index] = self.sent
+            if self.writers:
+                self.writers[index].submit(frame, window, self.sent)
+                continue
+
+            start = time.perf_counter()
+            write_frame(self.displays[index], frame.data, window)
+            if self.stats is not None:
+                self.stats.record(f"push.display_{index}", start)
+            self._written[index] += 1
+            self._sent(index, self.sent, self._written[index])
+        frame.release()
@@ -3,30 +3,32 @@ Kevinbot v3 Eyes
 Author: Kevin Ahr
 """
 
+import asyncio
+import atexit
 import enum
+import functools
 import json
-import threading
 import logging
+import signal
 import time
-import copy
-
-import board
-import digitalio
-import busio
-import numpy as np
-from adafruit_rgb_display import st7789
-from gpiozero import PWMLED, Device
-from gpiozero.pins.rpigpio import RPiGPIOFactory
+
 from PIL import Image, ImageDraw, ImageFont
-import serial
 
-from assets import AssetManager
+import assets
+import atlas
+import backends
+from persistence import SettingsWriter
+from scheduler import FrameScheduler
+from stats import FrameStats
+from sync import SettingsSync
+import commands
+import display
+import motion
+import noise
 import skins
+import tracing
 import utils
-
-# Change the default pin factory for gpiozero
-# Since there are some issues with the default lgpio factory, I am switching back to the RPi.GPIO factory
-Device.pin_factory = RPiGPIOFactory()
+import worker
 
 
 class VisualPage(utils.ExtendedIntEnum):
@@ -62,64 +64,39 @@ class Motions(utils.ExtendedIntEnum):
     MANUAL = 3
 
 
-class RobotEyes:
-    def __init__(self):
-        self.settings = {}
-        with open("settings.json", "r", encoding="UTF-8") as f:
-            self.settings = json.load(f)
+@functools.lru_cache(maxsize=8)
+def load_font(path, size):
+    """
+    Load a TrueType font, each font is only read from disk once
+    """
+    return ImageFont.truetype(path, size)
 
-        self.assets = AssetManager()
-        self.last_redraw = time.time()
-        self.previous_time = time.time()
-        self.error_border_visible = True
-        self.ser = serial.Serial(
-            self.settings["comms"]["port"], self.settings["comms"]["baud"]
-        )
 
-        self.visual_page = utils.clamp(
-            self.settings["states"]["page"], 0, len(VisualPage.list())
-        )
-        self.state = State.LOGO
-        self.motion = Motions(self.settings["states"]["motion"])
+class RobotEyes:
+    def __init__(self, settings_path="settings.json"):
+        boot_start = time.perf_counter()
 
-        # Init display
-        self.display_1_cs = digitalio.DigitalInOut(board.CE0)
-        self.display_1_dc = digitalio.DigitalInOut(board.D25)
-        self.display_1_rt = digitalio.DigitalInOut(board.D24)
+        self.settings = {}
+        with open(settings_path, "r", encoding="UTF-8") as f:
+            self.settings = json.load(f)
 
-        self.display_2_cs = digitalio.DigitalInOut(board.CE1)
-        self.display_2_dc = digitalio.DigitalInOut(board.D23)
-        self.display_2_rt = digitalio.DigitalInOut(board.D22)
+        # Rolling timings of each frame stage and of serial commands
+        self.stats = FrameStats(self.settings["stats"]["window"])
 
-        self.spi_0 = busio.SPI(clock=board.SCK, MOSI=board.MOSI)
-        self.spi_1 = busio.SPI(clock=board.SCK_1, MOSI=board.MOSI_1)
+        # Command-to-photon latency of serial commands, only when tracing
+        self.tracer = None
+        if self.settings["tracing"]["enabled"]:
+            self.tracer = tracing.LatencyTracer(
+                self.settings["stats"]["window"], self.settings["tracing"]["events"]
+            )
 
+        # Bring up the panels first, so the logo is shown as early as possible
         # Init display backlight
-        self.backlight = PWMLED(self.settings["display"]["backlight_pin"])
+        self.backlight = backends.open_backlight(self.settings)
         self.backlight.value = self.settings["display"]["backlight"] / 100
 
-        # Init ST7789 displays
-        self.display_0 = st7789.ST7789(
-            self.spi_0,
-            height=240,
-            y_offset=80,
-            rotation=180,
-            cs=self.display_1_cs,
-            dc=self.display_1_dc,
-            rst=self.display_1_rt,
-            baudrate=self.settings["display"]["speed"],
-        )
-
-        self.display_1 = st7789.ST7789(
-            self.spi_1,
-            height=240,
-            y_offset=80,
-            rotation=180,
-            cs=self.display_2_cs,
-            dc=self.display_2_dc,
-            rst=self.display_2_rt,
-            baudrate=self.settings["display"]["speed"],
-        )
+        # Init displays
+        self.display_0, self.display_1 = backends.open_displays(self.settings)
 
         # Detect if widht and height need to be swapped
         if self.display_0.rotation % 180 == 90:
@@ -129,42 +106,185 @@ class RobotEyes:
             self.width = self.display_0.width
             self.height = self.display_0.height
 
+        self.output = display.PanelOutput(
+            (self.display_0, self.display_1),
+            (self.width, self.height),
+            self.settings["display"]["partial_updates"],
+            self.settings["display"]["threaded_output"],
+            self.stats,
+        )
+        if self.tracer is not None:
+            self.output.on_sent = self.tracer.sent
+
+        # Rendered logo, loading and error pages
+        self.screen_cache = utils.LRUCache(8)
+
+        self.assets = assets.registry
+        self.output.push(*self.create_logo())
+        self.output.wait()
+        self.first_frame_time = (time.perf_counter() - boot_start) * 1000
+        logging.info("Logo shown %.1fms after start", self.first_frame_time)
+
+        # Decode the rest of the assets while everything else starts
+        self.assets.preload()
+
+        # Render skins in a separate process, it maps its own sprite atlas
+        self.render_worker = None
+        if self.settings["render_worker"]["enabled"]:
+            self.render_worker = worker.RenderWorker(
+                self.output.pool.shape,
+                (self.width, self.height),
+                self.output.rotation,
+                self.settings["render_worker"]["slots"],
+            )
+
+        # Map the sprite atlas, or rebuild it if the skins or assets changed
+        # Only the native compositing path uses its sprites
+        elif (
+            self.settings["atlas"]["enabled"]
+            and self.settings["display"]["native_compositing"]
+        ):
+            skins.atlas = atlas.SpriteAtlas(self.settings["atlas"]["path"])
+            skins.atlas.refresh_in_background(self.settings)
+
+        self.settings_sync = SettingsSync(
+            self.settings, transient=self.settings["persistence"]["transient"]
+        )
+        self.settings_writer = SettingsWriter(
+            self.settings, settings_path, self.settings["persistence"]["debounce"]
+        )
+        self.settings_writer.start()
+        # run() shuts down on SIGTERM and SIGINT, this covers any other exit
+        self.stopped = False
+        atexit.register(self.shutdown)
+
+        skins.sprite_cache.maxsize = self.settings["cache"]["sprites"]
+        self.previous_time = time.time()
+        self.error_border_visible = True
+        self.ser = backends.open_serial(self.settings)
+
+        self.visual_page = utils.clamp(
+            self.settings["states"]["page"], 0, len(VisualPage.list()) - 1
+        )
+        self.state = State.LOGO
+        self.motion = Motions(self.settings["states"]["motion"])
+
+        # Commands are parsed as they arrive and applied once per frame
+        self.commands = commands.CommandRegistry()
+        self.command_queue = commands.CommandQueue(self.stats, self.tracer)
+        self.command_stream = commands.CommandStream(self.commands, self.command_queue)
+        self.register_commands()
+
+        # Finished frames for the repeating motions, keyed by (page, x, y)
+        self.frame_cache = utils.LRUCache(
+            self.settings["cache"]["frames"]["memory_mb"]
+            * 1024
+            * 1024
+            // self.output.frame_bytes
+        )
+
+        self.tv_static = noise.TVStatic(self.output.pool)
+
+        self.scheduler = FrameScheduler(self.settings["frame_rate"]["logo"])
+
+        self.skin_styles = {
+            VisualPage.STATE_EYE_SIMPLE: skins.eye_simple_style,
+            VisualPage.STATE_EYE_METAL: skins.eye_metallic_style,
+            VisualPage.STATE_EYE_NEON: skins.eye_neon_style,
+        }
+        # The logo is already on the panels
+        self.shown = (self.state, self.visual_page)
+        self.start_time = time.time()
+        self.last_handshake_request = 0
+
+        # Idle detection, see update_idle
+        self.idle = False
+        self.last_activity = time.monotonic()
+        self.unchanged_frames = 0
+        self.wake_event = asyncio.Event()
+
         # Set initial eye position
+        self.motion_clock = motion.MotionClock()
         self.eye_x, self.eye_y = self.settings["motions"]["center_point"]
 
     def run(self):
         """
-        Run eyes in a loop
-        Start threads for serial and motion
+        Run eyes on a single asyncio event loop
+        Serial and rendering are both scheduled on it
         """
-        serial_thread = threading.Thread(target=self.serial_loop, daemon=True)
-        serial_thread.start()
+        try:
+            asyncio.run(self.run_async())
+        finally:
+            self.shutdown()
 
-        motion_thread = threading.Thread(target=self.eye_motion, daemon=True)
-        motion_thread.start()
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
 
-        self.main_loop()
+        # SIGTERM (systemd, shutdown) and SIGINT end the loop, run() cleans up
+        task = asyncio.current_task()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, task.cancel)
 
-    def save_settings(self):
+        # send settings on start
+        self.settings_sync.send(self.ser, "eye_settings.")
+        loop.add_reader(self.ser.fileno(), self.read_serial)
+        if self.render_worker is not None:
+            self.render_worker.attach(loop)
+
+        try:
+            await self.main_loop()
+        except asyncio.CancelledError:
+            logging.info("Stopping")
+
+    def shutdown(self):
         """
-        Save settings.json
+        Save pending settings and the trace, and stop the render worker
         """
-        with open("settings.json", "w", encoding="UTF-8") as file:
-            json.dump(self.settings, file, indent=2)
+        if self.stopped:
+            return
+        self.stopped = True
+
+        self.settings_writer.stop()
+        if self.render_worker is not None:
+            self.render_worker.stop()
+        if self.tracer is not None:
+            self.save_trace()
+
+    def save_settings(self, key=None):
+        """
+        Queue a save of settings.json
+        Changes to transient keys, like motions.pos, don't cause a write
+        """
+        if key is not None:
+            self.settings_sync.touch(key)
+        if key in self.settings["persistence"]["transient"]:
+            return
+        self.settings_writer.mark_dirty()
+
+    def show_screen(self, key, render):
+        """
+        Get a full screen page as (frame, box, key)
+        The page is only rendered once, and only sent again when its key changes
+        """
+        frame = self.screen_cache.get(key, lambda: self.output.freeze(render()))
+        return frame, None, key
 
     def create_logo(self):
         """
-        Show Kevinbot v3 Logo on screen
+        Kevinbot v3 Logo screen
         """
-        image = self.assets.logo
-        self.display_0.image(image)
-        self.display_1.image(image)
+        return self.show_screen(("logo",), lambda: self.assets.logo)
 
     def create_loading(self):
         """
-        Show loading page while main system connects
+        Loading page shown while main system connects
         """
+        return self.show_screen(
+            ("loading", json.dumps(self.settings["loading_format"], sort_keys=True)),
+            self.render_loading,
+        )
 
+    def render_loading(self):
         # Create image
         image = Image.new("RGB", (self.width, self.height))
         draw = ImageDraw.Draw(image)
@@ -187,7 +307,7 @@ class RobotEyes:
         )
 
         # Init font
-        font = ImageFont.truetype(
+        font = load_font(
             self.settings["loading_format"]["font"],
             self.settings["loading_format"]["font_size"],
         )
@@ -203,11 +323,30 @@ class RobotEyes:
             fill=self.settings["loading_format"]["color"],
         )
 
-        # Display image
-        self.display_0.image(image)
-        self.display_1.image(image)
+        return image
 
     def error_periodic(self, error=0):
+        """
+        Error page
+        The border flashes every error_format.flash_speed seconds, 0 disables flashing
+        """
+        flash_speed = self.settings["error_format"]["flash_speed"]
+        self.error_border_visible = (
+            flash_speed <= 0 or int(time.monotonic() / flash_speed) % 2 == 0
+        )
+        border_visible = self.error_border_visible
+
+        return self.show_screen(
+            (
+                "error",
+                json.dumps(self.settings["error_format"], sort_keys=True),
+                error,
+                border_visible,
+            ),
+            lambda: self.render_error(error, border_visible),
+        )
+
+    def render_error(self, error=0, border_visible=True):
         # Create image
         image = Image.new("RGB", (self.width, self.height))
         draw = ImageDraw.Draw(image)
@@ -215,7 +354,11 @@ class RobotEyes:
         # Fill background
         draw.rectangle(
             (0, 0, self.width, self.height),
-            fill=self.settings["error_format"]["color"],
+            fill=(
+                self.settings["error_format"]["color"]
+                if border_visible
+                else self.settings["error_format"]["bg_color"]
+            ),
         )
 
         # Border
@@ -230,7 +373,7 @@ class RobotEyes:
         )
 
         # Init font
-        font = ImageFont.truetype(
+        font = load_font(
             self.settings["error_format"]["font"],
             self.settings["error_format"]["font_size"],
         )
@@ -249,265 +392,507 @@ class RobotEyes:
             fill=self.settings["error_format"]["color"],
         )
 
-        # Display image
-        self.display_0.image(image)
-        self.display_1.image(image)
+        return image
 
     def tv_static_periodic(self):
-        if self.last_redraw + 0.1 < time.time():
-            image = Image.new("RGB", (self.width, self.height))
-
-            random_pixels = np.random.randint(
-                0,
-                256,
-                size=(self.display_0.width // 2, self.display_0.height // 2, 3),
-                dtype=np.uint8,
-            )
-
-            # Repeat each pixel to form 2x2 blocks
-            static = np.repeat(np.repeat(random_pixels, 2, axis=0), 2, axis=1)
-
-            # Create a PIL Image from the numpy array
-            image = Image.fromarray(static)
-
-            self.display_0.image(image)
-            self.display_1.image(image)
-            self.last_redraw = time.time()
+        """
+        TV static page, drawn directly in panel format
+        """
+        self.tv_static.configure(
+            self.settings["tv_static"]["block_size"],
+            self.settings["tv_static"]["color"],
+            self.settings["tv_static"]["pool_size"],
+        )
+        return self.tv_static.frame(), None, None
 
     def eye_motion(self):
         """
-        Motion loop
-        
+        Move the eye to where it should be at this moment
+        Called when a frame is rendered
+
         Supports Smooth movement, Kevinbot v2 style jumpy motion, and manual control
         """
-        step = 0
-        while True:
-            if self.motion == Motions.LEFT_RIGHT:
-                """
-                Smooth movement with Cubic In Out curve
-                """
-                num_steps = utils.map_range(
-                    self.settings["motions"]["speed"], 0, 100, 620, 20
-                )
+        if self.motion == Motions.LEFT_RIGHT:
+            # Smooth movement with Cubic In Out curve
+            easing = motion.CUBIC_IN_OUT
+        elif self.motion == Motions.JUMP:
+            # Kevinbot v2 style jumpy motion
+            easing = motion.STEP_JUMP
+        elif self.motion == Motions.MANUAL:
+            # Manual control via serial commands
+            self.eye_x, self.eye_y = self.settings["motions"]["pos"]
+            return
+        else:
+            return
+
+        self.eye_x, self.eye_y = motion.eye_position(
+            easing,
+            self.motion_clock.phase(self.settings["motions"]["speed"]),
+            self.settings["motions"]["left_point"],
+            self.settings["motions"]["right_point"],
+            self.height,
+        )
 
-                self.eye_x = utils.map_range(
-                    utils.cubic_in_out(utils.reflect_mod(step, 1)),
-                    0,
-                    1,
-                    self.settings["motions"]["left_point"][0],
-                    self.settings["motions"]["right_point"][0],
-                )
-                self.eye_y = self.height // 2
+    def render_eye(self, page, pos):
+        """
+        Render an eye skin
 
-                time.sleep(0.01)
-                num_steps = utils.map_range(
-                    self.settings["motions"]["speed"], 0, 100, 620, 20
-                )
-                step += 2 / num_steps
-
-            elif self.motion == Motions.JUMP:
-                """
-                Kevinbot v2 style jumpy motion
-                """
-                num_steps = utils.map_range(
-                    self.settings["motions"]["speed"], 0, 100, 620, 20
-                )
+        While moving left and right, positions are quantized and finished
+        frames are cached, since the same frames repeat every cycle.
+        Both eyes share the cache.
+        """
+        native = self.settings["display"]["native_compositing"]
+        size = (self.width, self.height)
+        style = self.skin_styles[page]
 
-                self.eye_x = utils.map_range(
-                    utils.step_jump_curve(utils.reflect_mod(step, 1)),
-                    0,
-                    1,
-                    self.settings["motions"]["left_point"][0],
-                    self.settings["motions"]["right_point"][0],
-                )
-                self.eye_y = self.height // 2
+        step = self.frame_step()
+        if step is None:
+            start = time.perf_counter()
+            frame = style(self.settings, pos, size, native)
+            self.stats.record("composite", start)
+            return frame
 
-                time.sleep(0.01)
-                num_steps = utils.map_range(
-                    self.settings["motions"]["speed"], 0, 100, 620, 20
-                )
-                step += 2 / num_steps
+        pos = (round(pos[0] / step) * step, round(pos[1] / step) * step)
+
+        def create():
+            start = time.perf_counter()
+            image, box = style(self.settings, pos, size, native)
+            self.stats.record("composite", start)
+            return self.output.freeze(image), box
+
+        return self.frame_cache.get((page, *pos), create)
+
+    def frame_step(self):
+        """
+        Position step finished frames are cached at, None if they aren't cached
+        """
+        settings = self.settings["cache"]["frames"]
+        if not settings["enabled"] or self.motion not in (
+            Motions.LEFT_RIGHT,
+            Motions.JUMP,
+        ):
+            return None
+        return settings["step"]
+
+    def eye_views(self):
+        """
+        Skin page and position of each eye
+        """
+        views = []
+        for eye in self.settings["eyes"]:
+            # page 0 follows the shared page
+            page = VisualPage(eye["page"]) if eye["page"] else self.visual_page
+            views.append(
+                (page, (self.eye_x + eye["offset"][0], self.eye_y + eye["offset"][1]))
+            )
+        return views
 
-            elif self.motion == Motions.MANUAL:
-                """
-                Manual control via serial commands
-                """
-                self.eye_x, self.eye_y = self.settings["motions"]["pos"]
-                time.sleep(0.01)
+    def render_eyes(self):
+        """
+        Render the eyes, returns a list of (frame, box, key, panels) to push
 
-            else:
-                time.sleep(0.05)
+        Only rendered once when both eyes look the same,
+        otherwise each eye is rendered and sent to its own panel.
+        Nothing is rendered when the eyes haven't moved and no setting changed.
+        With the render worker, returns a future of that list instead.
+        """
+        views = self.eye_views()
+        key = ("eyes", tuple(views), self.settings_sync.version)
+        if self.output.is_current(key):
+            return []
+
+        if self.render_worker is not None and self.render_worker.alive:
+            return self.render_worker.render(
+                self.settings,
+                self.settings_sync.stable_version,
+                views,
+                self.frame_step(),
+                key,
+            )
+
+        if all(view == views[0] for view in views):
+            return [(*self.render_eye(*views[0]), key, None)]
+
+        return [
+            (*self.render_eye(page, pos), key, (index,))
+            for index, (page, pos) in enumerate(views)
+        ]
+
+    def frame_rate(self):
+        """
+        Target frame rate of the current state and skin
+        """
+        frame_rates = self.settings["frame_rate"]
+        if self.idle:
+            return self.settings["idle"]["frame_rate"]
+        if self.state == State.LOGO:
+            return frame_rates["logo"]
+        if self.state == State.WAIT:
+            return frame_rates["loading"]
+        if self.state == State.ERORR:
+            return frame_rates["error"]
+
+        return frame_rates[
+            {
+                VisualPage.STATE_TV_STATIC: "tv_static",
+                VisualPage.STATE_EYE_SIMPLE: "simple",
+                VisualPage.STATE_EYE_METAL: "metal",
+                VisualPage.STATE_EYE_NEON: "neon",
+            }[self.visual_page]
+        ]
 
     def request_handshake(self):
         """
         Send a handshake request to the core
         """
-        self.ser.write(b"handshake.request\n")
+        if self.settings["comms"]["binary"]:
+            self.ser.write(b"handshake.request=binary\n")
+        else:
+            self.ser.write(b"handshake.request\n")
+
+    def render_frame(self):
+        """
+        Render the current state
 
-    def main_loop(self):
+        Returns a list of (frame, box, key, panels) for PanelOutput.push
+        """
+        # Send a full frame after switching screens
+        if self.shown != (self.state, self.visual_page):
+            self.shown = (self.state, self.visual_page)
+            self.output.invalidate()
+
+        # Display state
+        if self.state == State.LOGO:
+            if (
+                time.time() - self.start_time
+                > self.settings["logo_format"]["logo_time"]
+            ):
+                self.state = State.WAIT
+            return [self.create_logo()]
+        if self.state == State.WAIT:
+            if time.time() - self.last_handshake_request > 1:
+                self.request_handshake()
+                self.last_handshake_request = time.time()
+            return [self.create_loading()]
+        if self.state == State.ERORR:
+            return [self.error_periodic(self.settings["states"]["error"])]
+
+        # Eye skin state, tv static covers both eyes
+        if self.visual_page == VisualPage.STATE_TV_STATIC:
+            return [self.tv_static_periodic()]
+        self.eye_motion()
+        return self.render_eyes()
+
+    async def main_loop(self):
         """
         Display loop
 
         Update displays with skin
+        Blocking SPI writes run in an executor when there are no writer threads
         """
-        start_time = time.time()
+        loop = asyncio.get_running_loop()
+
+        self.start_time = time.time()
         self.request_handshake()
-        last_handshake_request = time.time()
+        self.last_handshake_request = time.time()
+        previous_start = time.perf_counter()
         while True:
-            # Display state
-            if self.state == State.LOGO:
-                self.create_logo()
-                if time.time() - start_time > self.settings["logo_format"]["logo_time"]:
-                    self.state = State.WAIT
-            elif self.state == State.WAIT:
-                self.create_loading()
-                if time.time() - last_handshake_request > 1:
-                    self.request_handshake()
-                    last_handshake_request = time.time()
-            elif self.state == State.ERORR:
-                self.error_periodic(self.settings["states"]["error"])
-            elif self.state == State.HOME:
-                # Eye skin state
-                if self.visual_page == VisualPage.STATE_TV_STATIC:
-                    self.tv_static_periodic()
-                elif self.visual_page == VisualPage.STATE_EYE_SIMPLE:
-                    skins.eye_simple_style(
-                        (self.display_0, self.display_1),
-                        self.last_redraw,
-                        self.settings,
-                        (self.eye_x, self.eye_y),
-                        (self.width, self.height),
-                    )
-                elif self.visual_page == VisualPage.STATE_EYE_METAL:
-                    skins.eye_metallic_style(
-                        (self.display_0, self.display_1),
-                        self.last_redraw,
-                        self.settings,
-                        (self.eye_x, self.eye_y),
-                        (self.width, self.height),
-                    )
-                elif self.visual_page == VisualPage.STATE_EYE_NEON:
-                    skins.eye_neon_style(
-                        (self.display_0, self.display_1),
-                        self.last_redraw,
-                        self.settings,
-                        (self.eye_x, self.eye_y),
-                        (self.width, self.height),
-                    )
-            time.sleep(0.022)  # 45fps
-
-    def serial_loop(self):
-        """
-        Loop to recieve serial data
+            start = time.perf_counter()
+            self.stats.record("interval", previous_start, start)
+            previous_start = start
+
+            # commands received until now are shown by this frame
+            traced = self.tracer.take() if self.tracer is not None else []
+            self.command_queue.apply()
+
+            sent = self.output.sent
+            submitted = list(self.output.submitted)
+            frames = self.render_frame()
+            if asyncio.isfuture(frames):
+                # the render worker renders while serial is handled
+                frames = await frames
+            rendered = time.perf_counter()
+            self.stats.record("render", start, rendered)
+            for frame in frames:
+                if self.output.writers:
+                    self.output.push(*frame)
+                else:
+                    await loop.run_in_executor(None, self.output.push, *frame)
+            self.stats.record("frame", start)
+            if self.tracer is not None:
+                self.tracer.rendered(
+                    traced,
+                    rendered,
+                    {
+                        index: sequence
+                        for index, sequence in enumerate(self.output.submitted)
+                        if sequence != submitted[index]
+                    },
+                )
+            self.update_idle(self.output.sent != sent)
+
+            self.scheduler.set_rate(self.frame_rate())
+            if not self.idle:
+                await asyncio.sleep(self.scheduler.delay())
+                continue
+
+            # Sleep longer while idle, serial commands wake the loop right away
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), self.scheduler.delay())
+            except asyncio.TimeoutError:
+                pass
+            self.wake_event.clear()
+
+    def update_idle(self, changed):
+        """
+        Go idle once nothing changed on the panels for idle.timeout seconds
+        While idle, the loop runs at idle.frame_rate and the backlight is dimmed
+        """
+        now = time.monotonic()
+        if changed:
+            self.unchanged_frames = 0
+            self.last_activity = now
+            self.wake()
+            return
+
+        self.unchanged_frames += 1
+        settings = self.settings["idle"]
+        if (
+            not self.idle
+            and settings["enabled"]
+            and now - self.last_activity > settings["timeout"]
+        ):
+            self.idle = True
+            self.backlight.value = settings["backlight"] / 100
+            logging.info("Idle, dimming the backlight")
+
+    def wake(self):
+        """
+        Leave idle mode, restoring the backlight and frame rate
         """
+        self.last_activity = time.monotonic()
+        if not self.idle:
+            return
+        self.idle = False
+        self.backlight.value = self.settings["display"]["backlight"] / 100
+        self.wake_event.set()
 
-        # send settings on start
-        settings_copy = copy.deepcopy(self.settings)
-        settings_copy.pop("error_format")
-        utils.send_data(settings_copy, self.ser, "eye_settings.")
+    def register_commands(self):
+        """
+        Register the serial commands
 
-        while True:
-            # decode data
-            data = self.ser.readline().decode("UTF-8")
-            pair = data.strip("\r\n").split("=", 1)
-
-            print(pair)
-            # commands that don't set a value
-            if pair[0] == "handshake.complete":
-                self.state = State.HOME
-            # comands that do set a value
-            elif len(pair) == 2:
-                if pair[0] == "setState":
-                    # set visual page of display
-                    if pair[1].isdigit():
-                        self.settings["states"]["page"] = utils.clamp(
-                            int(pair[1]), 1, len(VisualPage.list())
-                        )
-                        self.visual_page = VisualPage(self.settings["states"]["page"])
-                        self.save_settings()
-                        previous_time = time.time()
-                elif pair[0] == "setError":
-                    # retrieve an error code display
-                    if pair[1].isdigit():
-                        self.settings["states"]["error"] = int(pair[1])
-                        self.save_settings()
-                elif pair[0] == "setSkinOption":
-                    # set a skin option
-                    option_pairs = pair[1].split(":") # ex: ["simple", "bg_color", "#000000"]
-
-                    # require there to be 3 values (skin name, option, and value)
-                    if len(option_pairs) == 3:
-                        # if the value consists of only digits, convert it to an int
-                        if option_pairs[2].isdigit():
-                            value = int(option_pairs[2])
-                        else:
-                            value = option_pairs[2]
-
-                        # check if the skin name is valid
-                        if not option_pairs[0] in self.settings["skins"]:
-                            logging.warning("Skin %s does not exist", option_pairs[0])
-                            continue
-
-                        # check if the option is valid
-                        if (
-                            not option_pairs[1]
-                            in self.settings["skins"][option_pairs[0]]
-                        ):
-                            logging.warning(
-                                "Option %s for %s does not exist",
-                                option_pairs[1],
-                                option_pairs[0],
-                            )
-                            continue
-
-                        # ensure that the option is not a list or tuple, they can't be changed as of now
-                        # TODO: Make list and tuple options compatible
-                        if type(
-                            self.settings["skins"][option_pairs[0]][option_pairs[1]]
-                        ) in (
-                            list,
-                            tuple,
-                        ):
-                            logging.warning("Cannot change a list or tuple object")
-                        else:
-                            self.settings["skins"][option_pairs[0]][
-                                option_pairs[1]
-                            ] = value
-                            self.save_settings()
-                    else:
-                        logging.warning("Expected 3 values, got %s", len(option_pairs))
-                elif pair[0] == "setMotion":
-                    # set the active motion mode
-                    if pair[1].isdigit():
-                        # check if the requested value is valid
-                        if int(pair[1]) in range(len(Motions.list())):
-                            self.settings["states"]["motion"] = int(pair[1])
-                            self.motion = Motions(int(pair[1]))
-                            self.save_settings()
-                    else:
-                        logging.warning("Expected digits, got %s", pair[1])
-                elif pair[0] == "getSettings":
-                    # send all settings over serial
-                    settings_copy = copy.deepcopy(self.settings)
-                    settings_copy.pop("error_format")
-                    utils.send_data(settings_copy, self.ser, "eyeSettings.")
-                elif pair[0] == "setBacklight":
-                    # set backlight brightness
-                    if pair[1].isdigit():
-                        self.backlight.value = int(pair[1]) / 100
-                        self.settings["display"]["backlight"] = int(pair[1])
-                        self.save_settings()
-                elif pair[0] == "setSpeed":
-                    if pair[1].isdigit():
-                        self.settings["motions"]["speed"] = int(pair[1])
-                        self.save_settings()
-                elif pair[0] == "setPosition":
-                    coord = pair[1].split(",", 1)
-                    self.settings["motions"]["pos"] = [int(coord[0]), int(coord[1])]
-                    self.save_settings()
-
-            else:
-                logging.warning("Expected 2 pairs, got %s", len(pair))
+        Commands with coalesce set only need their latest value per frame,
+        coalesce is how many leading arguments say what they set
+        """
+        # runs right away, it can switch the stream to binary framing
+        self.commands.register(
+            "handshake.complete",
+            self.handshake_complete,
+            (commands.text,),
+            required=0,
+            immediate=True,
+        )
+        self.commands.register(
+            "setState",
+            self.set_state,
+            (commands.integer(1, len(VisualPage.list()) - 1),),
+            opcode=0x01,
+            binary_format="B",
+        )
+        self.commands.register("setError", self.set_error, (commands.integer(0),))
+        self.commands.register(
+            "setSkinOption",
+            self.set_skin_option,
+            (commands.text, commands.text, commands.option_value),
+            separator=":",
+            coalesce=2,
+        )
+        self.commands.register(
+            "setMotion",
+            self.set_motion,
+            (commands.integer(0, len(Motions.list()) - 1),),
+            opcode=0x02,
+            binary_format="B",
+            coalesce=0,
+        )
+        self.commands.register(
+            "getSettings", self.get_settings, (commands.integer(0),), required=0
+        )
+        self.commands.register(
+            "setEyeSkin",
+            self.set_eye_skin,
+            (commands.integer(0, 1), commands.integer(0, len(VisualPage.list()) - 1)),
+            opcode=0x06,
+            binary_format="BB",
+            coalesce=1,
+        )
+        self.commands.register(
+            "setEyeOffset",
+            self.set_eye_offset,
+            (commands.integer(0, 1), commands.integer(), commands.integer()),
+            opcode=0x07,
+            binary_format="Bhh",
+            coalesce=1,
+        )
+        self.commands.register("getStats", self.get_stats)
+        self.commands.register("getLatency", self.get_latency)
+        self.commands.register("saveTrace", self.save_trace)
+        self.commands.register(
+            "setBacklight",
+            self.set_backlight,
+            (commands.integer(0, 100),),
+            opcode=0x03,
+            binary_format="B",
+            coalesce=0,
+        )
+        self.commands.register(
+            "setSpeed",
+            self.set_speed,
+            (commands.integer(0, 100),),
+            opcode=0x04,
+            binary_format="B",
+            coalesce=0,
+        )
+        self.commands.register(
+            "setPosition",
+            self.set_position,
+            (commands.integer(), commands.integer()),
+            opcode=0x05,
+            binary_format="hh",
+            coalesce=0,
+        )
+
+    def handshake_complete(self, mode=""):
+        # the core can switch to binary framing if we asked for it
+        self.command_stream.binary = (
+            mode == "binary" and self.settings["comms"]["binary"]
+        )
+        self.state = State.HOME
+
+    def set_state(self, page):
+        # set visual page of display
+        self.settings["states"]["page"] = utils.clamp(
+            page, 1, len(VisualPage.list()) - 1
+        )
+        self.visual_page = VisualPage(self.settings["states"]["page"])
+        self.frame_cache.invalidate()
+        self.output.invalidate()
+        self.save_settings("states.page")
+
+    def set_error(self, error):
+        # retrieve an error code display
+        self.settings["states"]["error"] = error
+        self.output.invalidate()
+        self.save_settings("states.error")
+
+    def set_skin_option(self, skin, option, value):
+        # check if the skin name is valid
+        if not skin in self.settings["skins"]:
+            logging.warning("Skin %s does not exist", skin)
+            return
+
+        # check if the option is valid
+        if not option in self.settings["skins"][skin]:
+            logging.warning("Option %s for %s does not exist", option, skin)
+            return
+
+        # ensure that the option is not a list or tuple, they can't be changed as of now
+        # TODO: Make list and tuple options compatible
+        if type(self.settings["skins"][skin][option]) in (list, tuple):
+            logging.warning("Cannot change a list or tuple object")
+            return
+
+        self.settings["skins"][skin][option] = value
+        skins.invalidate_sprites(skin, option)
+        if skins.atlas is not None and option in atlas.ATLAS_OPTIONS.get(skin, ()):
+            skins.atlas.refresh_in_background(self.settings)
+        self.frame_cache.invalidate()
+        self.output.invalidate()
+        self.save_settings(f"skins.{skin}.{option}")
+
+    def set_motion(self, mode):
+        # set the active motion mode
+        self.settings["states"]["motion"] = mode
+        self.motion = Motions(mode)
+        self.frame_cache.invalidate()
+        self.save_settings("states.motion")
+
+    def get_settings(self, since=None):
+        # send all settings, or only the ones changed since a version, over serial
+        self.settings_sync.send(self.ser, "eyeSettings.", since)
+
+    def set_eye_skin(self, eye, page):
+        # give one eye its own skin, 0 follows the shared page
+        self.settings["eyes"][eye]["page"] = page
+        self.output.invalidate()
+        self.save_settings("eyes")
+
+    def set_eye_offset(self, eye, x, y):
+        # move one eye relative to the shared position, for convergence or cross-eye
+        self.settings["eyes"][eye]["offset"] = [x, y]
+        self.save_settings("eyes")
+
+    def get_stats(self):
+        # send frame rate, stage timings and dropped frames over serial
+        utils.send_data(
+            {
+                "fps": round(self.stats.fps(), 1),
+                "first_frame_ms": round(self.first_frame_time, 1),
+                "idle": self.idle,
+                "unchanged_frames": self.unchanged_frames,
+                "coalesced": self.command_queue.coalesced,
+                "frames": self.scheduler.frames,
+                "late": self.scheduler.late,
+                "skipped": self.scheduler.skipped,
+                "dropped": self.output.dropped,
+                "worker_busy": (
+                    self.render_worker.busy if self.render_worker is not None else 0
+                ),
+                "stages": self.stats.summary(),
+            },
+            self.ser,
+            "eyeStats.",
+        )
+
+    def get_latency(self):
+        # send command-to-photon latency of each command over serial
+        if self.tracer is None:
+            logging.warning("Latency tracing is disabled")
+            return
+        utils.send_data(self.tracer.summary(), self.ser, "eyeLatency.")
+
+    def save_trace(self):
+        # save command traces to tracing.path
+        if self.tracer is None:
+            logging.warning("Latency tracing is disabled")
+            return
+        count = self.tracer.save(self.settings["tracing"]["path"])
+        logging.info(
+            "Saved %s command traces to %s", count, self.settings["tracing"]["path"]
+        )
+
+    def set_backlight(self, brightness):
+        # set backlight brightness
+        self.backlight.value = brightness / 100
+        self.settings["display"]["backlight"] = brightness
+        self.save_settings("display.backlight")
+
+    def set_speed(self, speed):
+        self.settings["motions"]["speed"] = speed
+        self.save_settings("motions.speed")
+
+    def set_position(self, x, y):
+        self.settings["motions"]["pos"] = [x, y]
+        self.save_settings("motions.pos")
+
+    def read_serial(self):
+        """
+        Handle everything waiting on the serial port
+        Called by the event loop when the port is readable
+        """
+        self.wake()
+        self.command_stream.feed(self.ser.read(max(self.ser.in_waiting, 1)))
+        self.command_stream.process()
 
 
 if __name__ == "__main__":
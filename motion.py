@@ -0,0 +1,76 @@
+"""
+Eye motion for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import time
+
+import utils
+
+
+class EasingTable:
+    """
+    Precomputed easing curve on [0, 1]
+    """
+
+    def __init__(self, curve, size=1024):
+        self.size = size
+        self.table = [curve(i / (size - 1)) for i in range(size)]
+
+    def __call__(self, t):
+        return self.table[round(utils.clamp(t, 0, 1) * (self.size - 1))]
+
+
+CUBIC_IN_OUT = EasingTable(utils.cubic_in_out)
+STEP_JUMP = EasingTable(utils.step_jump_curve)
+
+
+def phase_rate(speed):
+    """
+    Motion phase per second for a speed setting
+    A phase of 2 is a full left, right and back cycle
+    """
+    # The old motion thread advanced 2 / num_steps every 10ms
+    return 100 * 2 / utils.map_range(speed, 0, 100, 620, 20)
+
+
+class MotionClock:
+    """
+    Motion phase as a function of monotonic time
+
+    When the speed changes, the phase continues from where it is instead
+    of jumping to where the new speed would have put it.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.start_phase = 0
+        self.rate = 0
+
+    def phase(self, speed, now=None):
+        """
+        Motion phase at a point in time, defaults to now
+        """
+        if now is None:
+            now = self.clock()
+
+        rate = phase_rate(speed)
+        if rate != self.rate:
+            self.start_phase += (now - self.start) * self.rate
+            self.start = now
+            self.rate = rate
+
+        return self.start_phase + (now - self.start) * rate
+
+
+def eye_position(easing, phase, left_point, right_point, height):
+    """
+    Eye position for a left and right motion
+    """
+    return (
+        utils.map_range(
+            easing(utils.reflect_mod(phase, 1)), 0, 1, left_point[0], right_point[0]
+        ),
+        height // 2,
+    )
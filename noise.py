@@ -0,0 +1,124 @@
+"""
+TV static for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import logging
+
+import numpy as np
+
+import display
+
+# RGB565 value of every gray level
+GRAY565 = display.rgb565(
+    np.repeat(np.arange(256, dtype=np.uint8), 3).reshape(1, 256, 3)
+)[0]
+
+
+class TVStatic:
+    """
+    TV static drawn straight into panel frames
+
+    Noise is generated at block resolution and scaled up in place into a
+    frame from the output's pool, no images are created. Noise has no
+    orientation, so frames are drawn in panel orientation to begin with.
+    With a pool size, that many frames are generated once and then shown
+    in random order.
+    """
+
+    def __init__(self, pool: display.FramePool, seed=None):
+        self.pool = pool
+        self.rng = np.random.default_rng(seed)
+
+        self._requested = None
+        self._options = None
+        self._noise = None
+        self._frames = []
+        self._previous = None
+        self._live = None
+
+    def configure(self, block_size=2, color=True, pool_size=0):
+        """
+        Set up buffers for a set of options, does nothing if they didn't change
+        """
+        options = (block_size, color, pool_size)
+        if options == self._requested:
+            return
+        self._requested = options
+
+        if block_size < 1 or pool_size < 0:
+            logging.warning(
+                "Invalid tv_static block_size %s or pool_size %s", block_size, pool_size
+            )
+            block_size, pool_size = max(block_size, 1), max(pool_size, 0)
+        self._options = (block_size, color, pool_size)
+
+        height, width = self.pool.shape
+        self._noise = np.empty(
+            (-(-height // block_size), -(-width // block_size)), dtype=">u2"
+        )
+        self._frames = []
+        self._previous = None
+
+    def fill(self, data):
+        """
+        Draw new static into an RGB565 frame buffer
+        """
+        block_size, color, _ = self._options
+
+        if color:
+            # random RGB565 values are random 5/6/5 bit channels
+            self._noise.view(np.uint16)[...] = self.rng.integers(
+                0, 65536, self._noise.shape, dtype=np.uint16
+            )
+        else:
+            np.take(
+                GRAY565,
+                self.rng.integers(0, 256, self._noise.shape, dtype=np.uint8),
+                out=self._noise,
+            )
+
+        height, width = data.shape
+        if height % block_size == 0 and width % block_size == 0:
+            # widen the rows, then copy each one block_size times through a view
+            # (same bits on both sides, so the byte order can be left alone)
+            data.view(np.uint16).reshape(height // block_size, block_size, width)[
+                ...
+            ] = self._noise.view(np.uint16).repeat(block_size, 1)[:, None, :]
+        else:
+            data[...] = self._noise.repeat(block_size, 0).repeat(block_size, 1)[
+                :height, :width
+            ]
+
+    def frame(self) -> display.Frame:
+        """
+        Next frame of static
+        """
+        _, _, pool_size = self._options
+
+        if pool_size > 0:
+            if len(self._frames) < pool_size:
+                frame = display.Frame(None, np.empty(self.pool.shape, dtype=">u2"))
+                self.fill(frame.data)
+                self._frames.append(frame)
+                self._previous = len(self._frames) - 1
+                return frame
+
+            if pool_size == 1:
+                return self._frames[0]
+
+            # never show the same frame twice in a row
+            index = self.rng.integers(pool_size - 1)
+            if index >= self._previous:
+                index += 1
+            self._previous = index
+            return self._frames[index]
+
+        # Hold on to the last frame until the next one is drawn,
+        # writers keep their own reference while sending it
+        frame = self.pool.acquire()
+        self.fill(frame.data)
+        if self._live is not None:
+            self._live.release()
+        self._live = frame
+        return frame
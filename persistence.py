@@ -0,0 +1,88 @@
+"""
+Settings persistence for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class SettingsWriter(threading.Thread):
+    """
+    Save settings in the background
+
+    Changes are coalesced and written once per debounce interval, so a
+    stream of commands doesn't turn into a stream of SD card writes.
+    Files are written to a temporary file and renamed over settings.json,
+    so a power cut never leaves a half written file behind.
+    """
+
+    def __init__(self, settings: dict, path="settings.json", debounce=2.0):
+        super().__init__(daemon=True)
+        self.settings = settings
+        self.path = path
+        self.debounce = debounce
+        self.writes = 0
+
+        self._dirty = False
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+
+    def mark_dirty(self):
+        """
+        Queue a save
+        """
+        with self._condition:
+            self._dirty = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._dirty and not self._stopping:
+                    self._condition.wait()
+
+                # Collect everything that changes during the interval
+                deadline = time.monotonic() + self.debounce
+                while not self._stopping and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+
+                if self._stopping:
+                    return
+
+            self.flush()
+
+    def flush(self):
+        """
+        Write pending changes now
+        """
+        with self._condition:
+            if not self._dirty:
+                return
+            self._dirty = False
+
+        with self._write_lock:
+            try:
+                data = json.dumps(self.settings, indent=2)
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, "w", encoding="UTF-8") as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self.path)
+                self.writes += 1
+            except (OSError, TypeError, ValueError):
+                logging.exception("Failed to save settings")
+
+    def stop(self):
+        """
+        Stop the writer, saving anything still pending
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.flush()
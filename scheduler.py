@@ -0,0 +1,51 @@
+"""
+Frame scheduling for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import time
+
+
+class FrameScheduler:
+    """
+    Pace frames to absolute deadlines
+
+    Render time is taken out of the wait, so frames don't drift.
+    When a frame overruns, the missed frame slots are skipped instead of
+    being rendered back to back.
+    """
+
+    def __init__(self, fps=45):
+        self.interval = 1 / fps
+        self.deadline = time.monotonic()
+
+        self.frames = 0
+        self.late = 0
+        self.skipped = 0
+
+    def set_rate(self, fps):
+        """
+        Change the target frame rate, starting from now
+        """
+        interval = 1 / fps
+        if interval != self.interval:
+            self.interval = interval
+            self.deadline = time.monotonic()
+
+    def delay(self):
+        """
+        Schedule the next frame, returns how long to wait until it is due
+        """
+        self.frames += 1
+        self.deadline += self.interval
+
+        now = time.monotonic()
+        if now < self.deadline:
+            return self.deadline - now
+
+        # Behind, skip the slots that were missed and start right away
+        self.late += 1
+        missed = int((now - self.deadline) / self.interval)
+        self.skipped += missed
+        self.deadline += missed * self.interval
+        return 0
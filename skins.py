@@ -3,164 +3,282 @@ Skins for Kevinbot v3 Eyes
 Author: Kevin Ahr
 """
 
-import os
-import time
+import math
 
-from adafruit_rgb_display.rgb import Display
 from PIL import Image, ImageDraw
 
-from assets import AssetManager
+from assets import registry as assets
+from compositor import LayeredSkin
+import display
 import utils
 
+# Resized and recolored sprites and skin bases,
+# keyed by (skin, asset, iris_size/size, tint/color/options)
+sprite_cache = utils.LRUCache(320)
 
-assets = AssetManager()
+# Pre-rendered sprites, an atlas.SpriteAtlas set up by main
+# Sprites missing from it are rendered when they are needed
+atlas = None
 
+# Skin options that change the look of cached sprites
+SPRITE_OPTIONS = {
+    "simple": ("bg_color",),
+    "metal": ("bg_color", "iris_size", "tint"),
+    "neon": ("bg_color", "iris_size", "style", "fg_color_start", "fg_color_end"),
+}
 
-def eye_simple_style(
-    displays: tuple[Display],
-    last_redraw,
-    settings,
-    pos: iter = (120, 120),
-    size: iter = (240, 240),
-):
+
+def invalidate_sprites(skin, option=None):
     """
-    Simple Eye Skin
-    Kevinbot v2 Style Eye
+    Drop cached sprites of a skin after one of its options changed
     """
-    eye_x, eye_y = pos
+    if option is None or option in SPRITE_OPTIONS.get(skin, ()):
+        sprite_cache.invalidate(skin)
 
-    if last_redraw + 0.05 < time.time():
-        image = Image.new("RGB", (size[0], size[1]))
-        draw = ImageDraw.Draw(image)
 
-        draw.rectangle(
-            (0, 0, size[0], size[1]), fill=settings["skins"]["simple"]["bg_color"]
-        )
-        draw.ellipse(
-            (
-                eye_x - settings["skins"]["simple"]["iris_size"] // 2,
-                eye_y - settings["skins"]["simple"]["iris_size"] // 2,
-                eye_x + settings["skins"]["simple"]["iris_size"] // 2,
-                eye_y + settings["skins"]["simple"]["iris_size"] // 2,
-            ),
-            fill=settings["skins"]["simple"]["iris_color"],
-        )
+def metal_iris(iris_size, tint):
+    """
+    Get the resized metal iris and its hue shifted copy
+    """
 
-        draw.ellipse(
-            (
-                eye_x - settings["skins"]["simple"]["pupil_size"] // 2,
-                eye_y - settings["skins"]["simple"]["pupil_size"] // 2,
-                eye_x + settings["skins"]["simple"]["pupil_size"] // 2,
-                eye_y + settings["skins"]["simple"]["pupil_size"] // 2,
-            ),
-            fill=settings["skins"]["simple"]["pupil_color"],
-        )
+    def create():
+        iris = assets.iris.resize((iris_size, iris_size))
+        return iris, utils.shift_hue(iris, tint)
 
-        for disp in displays:
-            disp.image(image)
-        last_redraw = time.time()
+    return sprite_cache.get(("metal", "iris", iris_size, tint), create)
 
 
-def eye_metallic_style(
-    displays: tuple[Display],
-    last_redraw,
-    settings,
-    pos: iter = (120, 120),
-    size: iter = (240, 240),
-):
+def neon_iris(style, iris_size, color=None):
     """
-    Metalic Eye Skin
-    "Aluminum" background with realistic eye
+    Get a resized neon iris, recolored if a color is given
     """
-    eye_x, eye_y = pos
 
-    if last_redraw + 0.05 < time.time():
-        image = Image.new("RGB", (size[0], size[1]))
-        draw = ImageDraw.Draw(image)
+    def create():
+        if color is None:
+            return assets.neon(style).resize(
+                (iris_size, iris_size), Image.Resampling.LANCZOS
+            )
 
-        draw.rectangle(
-            (0, 0, size[0], size[1]), fill=settings["skins"]["metal"]["bg_color"]
-        )
+        return utils.color_shift(neon_iris(style, iris_size), color)
 
-        iris = assets.iris.resize(
-            (
-                settings["skins"]["metal"]["iris_size"],
-                settings["skins"]["metal"]["iris_size"],
-            )
-        )
-        shifted_iris = utils.shift_hue(iris, settings["skins"]["metal"]["tint"])
+    return sprite_cache.get(("neon", style, iris_size, color), create)
 
-        image.paste(assets.aluminum.resize((size[0], size[1])), (0, 0))
 
-        image.paste(
-            shifted_iris,
-            (int(eye_x - iris.width // 2), int(eye_y - iris.height // 2)),
-            iris,
-        )
+def atlas_sprite(key):
+    """
+    Get a sprite from the atlas, None if there is no atlas or it doesn't have it
+    """
+    if atlas is None:
+        return None
+    return atlas.get(key)
+
 
-        for disp in displays:
-            disp.image(image)
-        last_redraw = time.time()
+def metal_iris565(iris_size, tint):
+    """
+    Get the metal iris pre-converted to RGB565
+    """
+    key = ("metal", "iris.rgb565", iris_size, tint)
+
+    def create():
+        sprite = atlas_sprite(key)
+        if sprite is None:
+            iris, shifted_iris = metal_iris(iris_size, tint)
+            sprite = display.Sprite565(shifted_iris, iris)
+        return sprite
 
+    return sprite_cache.get(key, create)
 
-def eye_neon_style(
-    displays: tuple[Display],
-    last_redraw,
-    settings,
-    pos: iter = (120, 120),
-    size: iter = (240, 240),
-):
+
+def neon_iris565(style, iris_size, color):
     """
-    Neon Eye Skin
+    Get a recolored neon iris pre-converted to RGB565
     """
-    eye_x, eye_y = pos
+    key = ("neon", f"{style}.rgb565", iris_size, color)
 
-    if last_redraw + 0.05 < time.time():
-        image = Image.new("RGB", (size[0], size[1]))
-        draw = ImageDraw.Draw(image)
+    def create():
+        sprite = atlas_sprite(key)
+        if sprite is None:
+            sprite = display.Sprite565(neon_iris(style, iris_size, color))
+        return sprite
+
+    return sprite_cache.get(key, create)
+
+
+def iris_box(pos, width, height):
+    """
+    Bounding box of an iris centered on pos
+    """
+    x = int(pos[0] - width // 2)
+    y = int(pos[1] - height // 2)
+    return x, y, x + width, y + height
 
-        draw.rectangle(
-            (0, 0, size[0], size[1]), fill=settings["skins"]["neon"]["bg_color"]
-        )
 
-        iris_image = Image.open(
-            os.path.join("assets", "neon", settings["skins"]["neon"]["style"])
+def ellipse_box(pos, diameter):
+    """
+    Bounding box of a circle drawn with PIL, ellipses include their end point
+    """
+    radius = diameter // 2
+    return (
+        math.floor(pos[0] - radius),
+        math.floor(pos[1] - radius),
+        math.ceil(pos[0] + radius) + 1,
+        math.ceil(pos[1] + radius) + 1,
+    )
+
+
+def fill_background(skin):
+    """
+    Static layer filling the frame with a skin's bg_color
+    """
+
+    def layer(image, settings, size):
+        ImageDraw.Draw(image).rectangle(
+            (0, 0, size[0], size[1]), fill=settings["skins"][skin]["bg_color"]
         )
-        iris = iris_image.resize(
+
+    return layer
+
+
+def aluminum_texture(image, settings, size):
+    """
+    Static layer with the "aluminum" texture of the metal skin
+    """
+    image.paste(assets.aluminum.resize((size[0], size[1])), (0, 0))
+
+
+def simple_circle(part):
+    """
+    Dynamic layer drawing the iris or the pupil of the simple skin
+    """
+
+    def layer(image, settings, pos):
+        eye_x, eye_y = pos
+        diameter = settings["skins"]["simple"][f"{part}_size"]
+
+        ImageDraw.Draw(image).ellipse(
             (
-                settings["skins"]["neon"]["iris_size"],
-                settings["skins"]["neon"]["iris_size"],
+                eye_x - diameter // 2,
+                eye_y - diameter // 2,
+                eye_x + diameter // 2,
+                eye_y + diameter // 2,
             ),
-            Image.Resampling.LANCZOS,
+            fill=settings["skins"]["simple"][f"{part}_color"],
         )
+        return ellipse_box(pos, diameter)
 
-        motion_progress = utils.clamp(
-            utils.map_range(
-                eye_x,
-                settings["motions"]["left_point"][0],
-                settings["motions"]["right_point"][0],
-                0,
-                100,
-            ),
+    return layer
+
+
+def metal_iris_layer(image, settings, pos):
+    """
+    Dynamic layer with the tinted metal iris
+    """
+    iris, shifted_iris = metal_iris(
+        settings["skins"]["metal"]["iris_size"],
+        settings["skins"]["metal"]["tint"],
+    )
+    box = iris_box(pos, iris.width, iris.height)
+    image.paste(shifted_iris, box[:2], iris)
+    return box
+
+
+def metal_iris_layer565(frame, settings, pos):
+    """
+    Dynamic layer with the tinted metal iris, for RGB565 frames
+    """
+    iris = metal_iris565(
+        settings["skins"]["metal"]["iris_size"],
+        settings["skins"]["metal"]["tint"],
+    )
+    box = iris_box(pos, iris.width, iris.height)
+    display.blit565(frame, iris, box[0], box[1])
+    return box
+
+
+def neon_color(settings, pos):
+    """
+    Neon iris color, blended from fg_color_start to fg_color_end as the eye moves right
+    """
+    motion_progress = utils.clamp(
+        utils.map_range(
+            pos[0],
+            settings["motions"]["left_point"][0],
+            settings["motions"]["right_point"][0],
             0,
             100,
-        )
+        ),
+        0,
+        100,
+    )
 
-        shifted_iris = utils.color_shift(
-            iris,
-            utils.blend_colors(
-                settings["skins"]["neon"]["fg_color_start"],
-                settings["skins"]["neon"]["fg_color_end"],
-                motion_progress / 100,
-            ),
-        )
+    return utils.blend_colors(
+        settings["skins"]["neon"]["fg_color_start"],
+        settings["skins"]["neon"]["fg_color_end"],
+        motion_progress / 100,
+    )
 
-        image.paste(
-            shifted_iris,
-            (int(eye_x - iris.width // 2), int(eye_y - iris.height // 2)),
-            iris,
-        )
 
-        for disp in displays:
-            disp.image(image)
-        last_redraw = time.time()
+def neon_iris_layer(image, settings, pos):
+    """
+    Dynamic layer with the recolored neon iris
+    """
+    iris = neon_iris(
+        settings["skins"]["neon"]["style"], settings["skins"]["neon"]["iris_size"]
+    )
+    shifted_iris = neon_iris(
+        settings["skins"]["neon"]["style"],
+        settings["skins"]["neon"]["iris_size"],
+        neon_color(settings, pos),
+    )
+    box = iris_box(pos, iris.width, iris.height)
+    image.paste(shifted_iris, box[:2], iris)
+    return box
+
+
+def neon_iris_layer565(frame, settings, pos):
+    """
+    Dynamic layer with the recolored neon iris, for RGB565 frames
+    """
+    iris = neon_iris565(
+        settings["skins"]["neon"]["style"],
+        settings["skins"]["neon"]["iris_size"],
+        neon_color(settings, pos),
+    )
+    box = iris_box(pos, iris.width, iris.height)
+    display.blit565(frame, iris, box[0], box[1])
+    return box
+
+
+# Skins are called as style(settings, pos, size, native)
+# and return the frame and the box the eye was drawn in
+
+# Simple Eye Skin
+# Kevinbot v2 Style Eye, always drawn with PIL
+eye_simple_style = LayeredSkin(
+    "simple",
+    sprite_cache,
+    static=(fill_background("simple"),),
+    dynamic=(simple_circle("iris"), simple_circle("pupil")),
+    options=("bg_color",),
+)
+
+# Metalic Eye Skin
+# "Aluminum" background with realistic eye
+eye_metallic_style = LayeredSkin(
+    "metal",
+    sprite_cache,
+    static=(fill_background("metal"), aluminum_texture),
+    dynamic=(metal_iris_layer,),
+    native=(metal_iris_layer565,),
+    options=("bg_color",),
+)
+
+# Neon Eye Skin
+eye_neon_style = LayeredSkin(
+    "neon",
+    sprite_cache,
+    static=(fill_background("neon"),),
+    dynamic=(neon_iris_layer,),
+    native=(neon_iris_layer565,),
+    options=("bg_color",),
+)
@@ -0,0 +1,143 @@
+"""
+Frame timing statistics for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import math
+import threading
+import time
+
+
+class RollingHistogram:
+    """
+    Histogram of the last window durations
+
+    Durations go into log spaced buckets, eight per doubling starting at
+    1us, so percentiles are within about 5% of the real value.
+    Recording is constant time, percentiles are only worked out on request.
+    """
+
+    BUCKETS_PER_DOUBLING = 8
+    MINIMUM = 0.001  # ms
+    BUCKETS = 8 * 20  # up to about 1s
+
+    def __init__(self, window=512):
+        self.window = window
+        self.count = 0
+        self.total = 0.0
+
+        self._samples = [0.0] * window
+        self._index = 0
+        self._counts = [0] * self.BUCKETS
+
+    def bucket(self, value):
+        """
+        Bucket index of a duration in milliseconds
+        """
+        if value <= self.MINIMUM:
+            return 0
+        index = int(math.log2(value / self.MINIMUM) * self.BUCKETS_PER_DOUBLING)
+        return min(index, self.BUCKETS - 1)
+
+    def record(self, value):
+        """
+        Add a duration in milliseconds, dropping the oldest once the window is full
+        """
+        if self.count == self.window:
+            old = self._samples[self._index]
+            self._counts[self.bucket(old)] -= 1
+            self.total -= old
+        else:
+            self.count += 1
+
+        self._samples[self._index] = value
+        self._counts[self.bucket(value)] += 1
+        self.total += value
+        self._index = (self._index + 1) % self.window
+
+    def percentile(self, percent):
+        """
+        Approximate duration below which percent of the window falls
+        """
+        if not self.count:
+            return 0.0
+
+        target = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                # middle of the bucket, on a log scale
+                middle = self.MINIMUM * 2 ** ((index + 0.5) / self.BUCKETS_PER_DOUBLING)
+                return min(middle, self.maximum)
+        return self.maximum
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def maximum(self):
+        return max(self._samples[: self.count], default=0.0)
+
+    def summary(self):
+        """
+        Percentiles, mean and maximum of the window, in milliseconds
+        """
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 3),
+            "p50": round(self.percentile(50), 3),
+            "p90": round(self.percentile(90), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.maximum, 3),
+        }
+
+
+class FrameStats:
+    """
+    Timing of each stage of a frame
+
+    Stages are created on first use. Each stage is only recorded from
+    one thread, so recording doesn't need a lock.
+    """
+
+    def __init__(self, window=512):
+        self.window = window
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name) -> RollingHistogram:
+        """
+        Histogram for a stage
+        """
+        histogram = self.stages.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(name, RollingHistogram(self.window))
+        return histogram
+
+    def record(self, name, start, end=None):
+        """
+        Record a stage that started at start, a time.perf_counter() value
+        """
+        if end is None:
+            end = time.perf_counter()
+        self.stage(name).record((end - start) * 1000)
+
+    def fps(self):
+        """
+        Frame rate over the window, from the time between frames
+        """
+        interval = self.stages.get("interval")
+        if interval is None or not interval.mean:
+            return 0.0
+        return 1000 / interval.mean
+
+    def summary(self):
+        """
+        Summaries of every stage
+        """
+        with self._lock:
+            stages = dict(self.stages)
+        return {name: histogram.summary() for name, histogram in stages.items()}
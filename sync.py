@@ -0,0 +1,78 @@
+"""
+Settings sync for Kevinbot v3 Eyes
+Author: Kevin Ahr
+"""
+
+import json
+import threading
+
+import serial
+
+import utils
+
+
+class SettingsSync:
+    """
+    Send settings to the core
+
+    Every settings key has the version it was last changed at, so the core
+    can ask for only what changed since the last version it has seen.
+    stable_version only counts changes to keys that aren't transient.
+    """
+
+    def __init__(self, settings: dict, excluded=("error_format",), transient=()):
+        self.settings = settings
+        self.excluded = excluded
+        self.transient = transient
+        self.version = 0
+        self.stable_version = 0
+
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def touch(self, key):
+        """
+        Record a change to a dotted settings key
+        """
+        with self._lock:
+            self.version += 1
+            self._versions[key] = self.version
+            if key not in self.transient:
+                self.stable_version = self.version
+
+    def changed(self, key, since):
+        """
+        Check if a key, or one of its parents, changed after a version
+        """
+        parts = key.split(".")
+        return any(
+            self._versions.get(".".join(parts[:length]), 0) > since
+            for length in range(1, len(parts) + 1)
+        )
+
+    def dump(self, prefix="", since=None) -> bytes:
+        """
+        Serialize settings as key=value lines followed by the current version
+        Only keys changed after since are included, all of them if since is None
+        """
+        data = {
+            key: value
+            for key, value in self.settings.items()
+            if key not in self.excluded
+        }
+
+        with self._lock:
+            lines = [
+                f"{prefix}{key}={json.dumps(value)}\n"
+                for key, value in utils.flatten_data(data)
+                if since is None or self.changed(key, since)
+            ]
+            lines.append(f"{prefix.rstrip('.')}Version={self.version}\n")
+
+        return "".join(lines).encode()
+
+    def send(self, ser: serial.Serial, prefix="", since=None):
+        """
+        Send settings in a single buffered write
+        """
+        ser.write(self.dump(prefix, since))
@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def repo(monkeypatch):
+    """
+    Run from the repository root, assets are found relative to it
+    """
+    monkeypatch.chdir(ROOT)
+    return ROOT
+
+
+@pytest.fixture
+def settings_path(tmp_path):
+    """
+    Copy of settings.json using the framebuffer, null and loopback backends
+    """
+    with open(os.path.join(ROOT, "settings.json"), "r", encoding="UTF-8") as f:
+        settings = json.load(f)
+    settings["backends"].update(
+        display="framebuffer", backlight="null", serial="loopback", frame_dump=""
+    )
+    settings["display"]["threaded_output"] = False
+    settings["atlas"]["enabled"] = False
+    settings["render_worker"]["enabled"] = False
+    settings["tracing"]["enabled"] = False
+    path = tmp_path / "settings.json"
+    path.write_text(json.dumps(settings, indent=2))
+    return path
+
+
+@pytest.fixture
+def eyes(settings_path, repo):
+    """
+    RobotEyes on the headless backends
+    """
+    import main
+
+    robot_eyes = main.RobotEyes(str(settings_path))
+    yield robot_eyes
+    robot_eyes.shutdown()
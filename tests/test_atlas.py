@@ -0,0 +1,53 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import atlas
+
+
+@pytest.fixture
+def skin_settings(repo):
+    with open(os.path.join(repo, "settings.json"), "r", encoding="UTF-8") as f:
+        return json.load(f)["skins"]
+
+
+def test_atlas_round_trip(tmp_path, skin_settings):
+    built = atlas.SpriteAtlas(str(tmp_path / "sprites.atlas"))
+    built.build(skin_settings)
+
+    # a fresh atlas maps the saved file
+    mapped = atlas.SpriteAtlas(built.path)
+    assert mapped.open(atlas.atlas_key(skin_settings))
+
+    count = 0
+    for key, sprite in atlas.atlas_sprites(skin_settings):
+        stored = mapped.get(key)
+        assert stored is not None, key
+        assert np.array_equal(stored.data, sprite.data)
+        assert np.array_equal(stored.alpha, sprite.alpha)
+        count += 1
+    assert count > 1
+    assert mapped.get(("metal", "iris.rgb565", 1, "missing")) is None
+
+
+def test_atlas_checks_key(tmp_path, skin_settings):
+    built = atlas.SpriteAtlas(str(tmp_path / "sprites.atlas"))
+    built.build(skin_settings)
+
+    changed = json.loads(json.dumps(skin_settings))
+    changed["metal"]["tint"] = (changed["metal"]["tint"] + 1) % 256
+    assert not atlas.SpriteAtlas(built.path).open(atlas.atlas_key(changed))
+
+    # refresh rebuilds for the new options
+    built.refresh({"skins": changed})
+    assert built.key == atlas.atlas_key(changed)
+    assert built.builds == 2
+
+
+def test_atlas_rejects_bad_files(tmp_path):
+    path = tmp_path / "sprites.atlas"
+    assert not atlas.SpriteAtlas(str(path)).open()
+    path.write_bytes(b"not an atlas at all")
+    assert not atlas.SpriteAtlas(str(path)).open()
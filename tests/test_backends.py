@@ -0,0 +1,8 @@
+import backends
+
+
+def test_pty_serial_drops_output_nobody_reads():
+    port = backends.PtySerial()
+    for _ in range(10000):
+        port.write(b"x" * 100)
+    assert port.dropped > 0
@@ -0,0 +1,128 @@
+import struct
+
+import commands
+
+
+def test_set_state_rejects_out_of_range(eyes):
+    # the tv static page can't be selected with setState
+    for value in (0, 4, -1):
+        assert eyes.commands.parse(f"setState={value}") is None
+    for value in (0, 4, 255):
+        assert eyes.commands.parse_binary(0x01, struct.pack(">B", value)) is None
+
+
+def test_set_state_selects_eye_skins(eyes):
+    for page in range(1, 4):
+        command, args = eyes.commands.parse(f"setState={page}")
+        command.handler(*args)
+        assert eyes.visual_page == page
+
+
+def registry(calls):
+    """
+    Registry with a few commands that record their calls
+    """
+    registry = commands.CommandRegistry()
+
+    def recorder(name):
+        return lambda *args: calls.append((name, *args))
+
+    registry.register(
+        "setLevel",
+        recorder("setLevel"),
+        (commands.integer(0, 100),),
+        opcode=0x01,
+        binary_format="B",
+        coalesce=0,
+    )
+    registry.register(
+        "setOption",
+        recorder("setOption"),
+        (commands.text, commands.option_value),
+        separator=":",
+        coalesce=1,
+    )
+    registry.register("setError", recorder("setError"), (commands.integer(0),))
+    registry.register("fail", lambda: 1 / 0)
+    return registry
+
+
+def test_parse_checks_ranges():
+    parser = registry([])
+    assert parser.parse("setLevel=100")[1] == [100]
+    assert parser.parse("setLevel=101") is None
+    assert parser.parse("setLevel=-1") is None
+    assert parser.parse("setLevel=high") is None
+    assert parser.parse_binary(0x01, struct.pack(">B", 42))[1] == [42]
+    assert parser.parse_binary(0x01, struct.pack(">B", 200)) is None
+    assert parser.parse_binary(0x02, b"") is None
+
+
+def test_parse_checks_argument_count():
+    parser = registry([])
+    assert parser.parse("setOption=neon:style:neon1.png")[1] == [
+        "neon",
+        "style:neon1.png",
+    ]
+    assert parser.parse("setOption=neon") is None
+    assert parser.parse("setLevel=") is None
+    assert parser.parse("unknown=1") is None
+
+
+def test_queue_coalesces_in_place():
+    calls = []
+    parser = registry(calls)
+    queue = commands.CommandQueue()
+    for line in (
+        "setLevel=1",
+        "setOption=a:1",
+        "setLevel=2",
+        "setOption=b:1",
+        "setOption=a:2",
+        "setLevel=3",
+    ):
+        queue.put(*parser.parse(line))
+
+    assert len(queue) == 3
+    assert queue.coalesced == 3
+    queue.apply()
+    assert calls == [("setLevel", 3), ("setOption", "a", 2), ("setOption", "b", 1)]
+
+
+def test_queue_keeps_order_around_ordered_commands():
+    calls = []
+    parser = registry(calls)
+    queue = commands.CommandQueue()
+    for line in ("setLevel=1", "setError=5", "setLevel=2", "setLevel=3"):
+        queue.put(*parser.parse(line))
+
+    queue.apply()
+    assert calls == [("setLevel", 1), ("setError", 5), ("setLevel", 3)]
+    assert len(queue) == 0
+
+
+def test_queue_survives_failing_commands():
+    calls = []
+    parser = registry(calls)
+    queue = commands.CommandQueue()
+    queue.put(*parser.parse("fail"))
+    queue.put(*parser.parse("setLevel=7"))
+    queue.apply()
+    assert calls == [("setLevel", 7)]
+
+
+def test_stream_splits_text_and_binary():
+    calls = []
+    parser = registry(calls)
+    queue = commands.CommandQueue()
+    stream = commands.CommandStream(parser, queue)
+    stream.binary = True
+
+    stream.feed(b"setError=1\n" + commands.BINARY_START + b"\x01")
+    stream.process()
+    stream.feed(b"\x09setErr")
+    stream.process()
+    stream.feed(b"or=2\n")
+    stream.process()
+    queue.apply()
+    assert calls == [("setError", 1), ("setLevel", 9), ("setError", 2)]
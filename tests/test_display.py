@@ -0,0 +1,64 @@
+import numpy as np
+
+import backends
+import display
+
+
+def test_frame_pool_recycles_released_frames():
+    pool = display.FramePool((4, 4))
+    frame = pool.acquire()
+    frame.retain()
+
+    frame.release()
+    assert pool.free == []
+    frame.release()
+    assert pool.free == [frame]
+    assert pool.acquire() is frame
+
+
+def test_frame_pool_hands_out_distinct_frames():
+    pool = display.FramePool((4, 4))
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    assert first.data.shape == (4, 4)
+    assert first.data.dtype == np.dtype(">u2")
+
+
+def test_frames_without_pool_are_kept():
+    frame = display.Frame(None, np.zeros((4, 4), ">u2"))
+    frame.retain()
+    frame.release()
+    frame.release()
+    assert frame._users == 0
+
+
+def output():
+    displays = tuple(backends.FramebufferDisplay(240, 240) for _ in range(2))
+    return displays, display.PanelOutput(displays, (240, 240))
+
+
+def test_push_releases_converted_frames():
+    _, panels = output()
+    panels.push(np.zeros((240, 240), ">u2"))
+    assert len(panels.pool.free) == 1
+
+
+def test_push_skips_unchanged_frames():
+    displays, panels = output()
+    image = np.full((240, 240), 0xF800, ">u2")
+    panels.push(image, key="red")
+    panels.push(image, key="red")
+    assert [disp.writes for disp in displays] == [1, 1]
+    assert panels.is_current("red")
+
+    panels.skip_unchanged = False
+    panels.push(image, key="red")
+    assert [disp.writes for disp in displays] == [2, 2]
+
+
+def test_push_to_one_panel():
+    displays, panels = output()
+    panels.push(np.full((240, 240), 0x001F, ">u2"), panels=(1,))
+    assert [disp.writes for disp in displays] == [0, 1]
+    assert panels.submitted == [0, 1]
@@ -0,0 +1,28 @@
+import json
+import subprocess
+import sys
+
+from conftest import ROOT
+
+# Changes the speed, then stops itself with SIGTERM well before the
+# settings writer's debounce runs out
+SCRIPT = """
+import os, signal, sys, threading
+import main
+
+eyes = main.RobotEyes(sys.argv[1])
+eyes.set_speed(13)
+threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM)).start()
+eyes.run()
+"""
+
+
+def test_sigterm_saves_pending_settings(settings_path):
+    process = subprocess.run(
+        [sys.executable, "-c", SCRIPT, str(settings_path)],
+        cwd=ROOT,
+        timeout=30,
+        capture_output=True,
+    )
+    assert process.returncode == 0, process.stderr.decode()
+    assert json.loads(settings_path.read_text())["motions"]["speed"] == 13
@@ -0,0 +1,23 @@
+import display
+import noise
+
+
+def test_single_frame_pool():
+    static = noise.TVStatic(display.FramePool((240, 240)), seed=1)
+    static.configure(2, True, 1)
+    assert static.frame() is static.frame()
+
+
+def test_pool_never_repeats_a_frame():
+    static = noise.TVStatic(display.FramePool((240, 240)), seed=1)
+    static.configure(1, False, 3)
+    frames = [static.frame() for _ in range(30)]
+    assert len({id(frame) for frame in frames}) == 3
+    assert all(a is not b for a, b in zip(frames, frames[1:]))
+
+
+def test_invalid_options_are_clamped():
+    static = noise.TVStatic(display.FramePool((240, 240)), seed=1)
+    static.configure(0, True, -1)
+    frame = static.frame()
+    assert frame.data.shape == (240, 240)
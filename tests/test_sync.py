@@ -0,0 +1,71 @@
+from sync import SettingsSync
+
+
+def settings():
+    return {
+        "states": {"page": 3, "motion": 1},
+        "skins": {"neon": {"style": "neon1.png", "iris_size": 100}},
+        "eyes": [{"page": 0, "offset": [0, 0]}],
+        "motions": {"pos": [120, 120]},
+        "error_format": {"text": "ERROR {0}"},
+    }
+
+
+def lines(sync, since=None):
+    return sync.dump("eye_settings.", since).decode().splitlines()
+
+
+def test_full_dump():
+    sync = SettingsSync(settings())
+    assert lines(sync) == [
+        "eye_settings.states.page=3",
+        "eye_settings.states.motion=1",
+        'eye_settings.skins.neon.style="neon1.png"',
+        "eye_settings.skins.neon.iris_size=100",
+        'eye_settings.eyes=[{"page": 0, "offset": [0, 0]}]',
+        "eye_settings.motions.pos=[120, 120]",
+        "eye_settingsVersion=0",
+    ]
+
+
+def test_delta_dumps():
+    sync = SettingsSync(settings(), transient=("motions.pos",))
+    sync.touch("states.page")  # 1
+    sync.touch("skins.neon")  # 2, a parent key covers every option under it
+    sync.touch("eyes")  # 3
+    sync.touch("motions.pos")  # 4
+
+    assert lines(sync, 0) == [
+        "eye_settings.states.page=3",
+        'eye_settings.skins.neon.style="neon1.png"',
+        "eye_settings.skins.neon.iris_size=100",
+        'eye_settings.eyes=[{"page": 0, "offset": [0, 0]}]',
+        "eye_settings.motions.pos=[120, 120]",
+        "eye_settingsVersion=4",
+    ]
+    assert lines(sync, 2) == [
+        'eye_settings.eyes=[{"page": 0, "offset": [0, 0]}]',
+        "eye_settings.motions.pos=[120, 120]",
+        "eye_settingsVersion=4",
+    ]
+    assert lines(sync, 4) == ["eye_settingsVersion=4"]
+
+    # transient keys don't count as stable changes
+    assert sync.version == 4
+    assert sync.stable_version == 3
+
+
+def test_get_settings_over_serial(eyes):
+    eyes.command_stream.feed(b"setSpeed=13\n")
+    eyes.command_stream.process()
+    eyes.command_queue.apply()
+    version = eyes.settings_sync.version
+
+    eyes.ser.written.clear()
+    eyes.command_stream.feed(f"getSettings={version - 1}\n".encode())
+    eyes.command_stream.process()
+    eyes.command_queue.apply()
+    assert eyes.ser.written.decode().splitlines() == [
+        "eyeSettings.motions.speed=13",
+        f"eyeSettingsVersion={version}",
+    ]
@@ -0,0 +1,61 @@
+import json
+
+import tracing
+
+
+def test_latency_after_every_panel_was_written():
+    tracer = tracing.LatencyTracer()
+    tracer.received("setPosition")
+    traces = tracer.take()
+    assert tracer.take() == []
+
+    tracer.rendered(traces, traces[0].received + 0.001, {0: 1, 1: 2})
+    tracer.sent(0, 1, 5)
+    assert tracer.summary()["commands"] == {}
+
+    tracer.sent(1, 2, 7)
+    summary = tracer.summary()["commands"]["setPosition"]
+    assert summary["render"]["count"] == 1
+    assert summary["photon"]["count"] == 1
+    assert traces[0].writes == {0: 5, 1: 7}
+
+
+def test_newer_frames_finish_dropped_ones():
+    tracer = tracing.LatencyTracer()
+    tracer.received("setState")
+    traces = tracer.take()
+    tracer.rendered(traces, traces[0].received, {0: 3})
+    # frame 3 was replaced by frame 4 before it was sent
+    tracer.sent(0, 4, 2)
+    assert traces[0].pushed is not None
+
+
+def test_panels_written_before_rendered_was_called():
+    tracer = tracing.LatencyTracer()
+    tracer.received("setState")
+    traces = tracer.take()
+    tracer.sent(0, 1, 1)
+    tracer.rendered(traces, traces[0].received, {0: 1})
+    assert traces[0].pushed is not None
+
+
+def test_commands_that_change_nothing_are_counted():
+    tracer = tracing.LatencyTracer()
+    tracer.received("getStats")
+    tracer.rendered(tracer.take(), 0, {})
+    assert tracer.summary() == {"unchanged": 1, "commands": {}}
+
+
+def test_save_chrome_trace(tmp_path):
+    tracer = tracing.LatencyTracer()
+    for name in ("setPosition", "setSkinOption"):
+        tracer.received(name)
+    traces = tracer.take()
+    tracer.rendered(traces, traces[-1].received, {0: 1})
+    tracer.sent(0, 1, 9)
+
+    path = tmp_path / "trace.json"
+    assert tracer.save(str(path)) == 2
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [event["ph"] for event in events] == ["b", "n", "e"] * 2
+    assert events[2]["args"]["writes"] == {"display_0": 9}
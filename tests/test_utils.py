@@ -0,0 +1,36 @@
+import os
+
+from PIL import Image
+
+import utils
+from benchmark import (
+    reference_blend_colors,
+    reference_color_shift,
+    reference_shift_hue,
+)
+
+
+def test_shift_hue_matches_reference(repo):
+    iris = Image.open(os.path.join("assets", "metal", "iris.png"))
+    for hue in (0, 1, 85, 171, 255, 300, -40):
+        assert (
+            utils.shift_hue(iris, hue).tobytes()
+            == reference_shift_hue(iris, hue).tobytes()
+        ), f"shift_hue differs for hue {hue}"
+
+
+def test_color_shift_matches_reference(repo):
+    for style in sorted(os.listdir(os.path.join("assets", "neon"))):
+        neon = Image.open(os.path.join("assets", "neon", style)).convert("RGBA")
+        for color in ("#0000ff", "#00ff00", "#12ab9f"):
+            assert (
+                utils.color_shift(neon, color).tobytes()
+                == reference_color_shift(neon, color).tobytes()
+            ), f"color_shift differs for {style} {color}"
+
+
+def test_blend_colors_matches_reference():
+    weights = [i / 100 for i in range(101)]
+    assert utils.blend_colors("#0000FF", "#00FF00", weights) == [
+        reference_blend_colors("#0000FF", "#00FF00", weight) for weight in weights
+    ]
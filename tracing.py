@@ -0,0 +1,185 @@
+"""
+Command latency tracing for Kevinbot v3 Eyes
+Author: Kevin Ahr
+
+Every received command is tagged with the time it arrived, the time the
+first frame reflecting it finished rendering, and the time that frame
+was written to every panel it changed (command-to-photon latency).
+
+Traces can be saved in the Chrome trace event format, for chrome://tracing
+or Perfetto. Each command notes the write number of the frame that showed
+it on every panel, with the framebuffer backend that is the number of the
+dumped frame_XXXXXX file of that panel.
+"""
+
+import collections
+import json
+import threading
+import time
+
+from stats import RollingHistogram
+
+
+class CommandTrace:
+    """
+    Timeline of one command, in perf_counter seconds
+    """
+
+    def __init__(self, name, received):
+        self.name = name
+        self.received = received
+        self.rendered = None
+        self.pushed = None
+        # write number of the frame that showed the command, for each panel
+        self.writes = {}
+
+
+class LatencyTracer:
+    """
+    Rolling render and photon latencies of each command
+
+    Commands are taken by the frame that applies them, and finish once
+    that frame, or a newer one, was written to every panel it changed.
+    Commands applied on frames that changed nothing are only counted.
+    The last events finished commands are kept for the trace file.
+    """
+
+    def __init__(self, window=512, events=10000):
+        self.window = window
+        self.unchanged = 0
+        self.render = {}
+        self.photon = {}
+        self.traces = collections.deque(maxlen=events)
+
+        self._start = time.perf_counter()
+        self._received = []
+        self._in_flight = []
+        # Last (sequence, write, time) written to each panel
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def received(self, name):
+        """
+        Tag a command as it arrives
+        """
+        with self._lock:
+            self._received.append(CommandTrace(name, time.perf_counter()))
+
+    def take(self):
+        """
+        Take the commands received so far, call right before applying them
+        """
+        with self._lock:
+            traces, self._received = self._received, []
+        return traces
+
+    def rendered(self, traces, end, targets):
+        """
+        Mark commands as shown by a frame that finished rendering at end
+        targets has the push sequence of the frame for each panel it changed
+        """
+        if not traces:
+            return
+        if not targets:
+            self.unchanged += len(traces)
+            return
+
+        for trace in traces:
+            trace.rendered = end
+
+        with self._lock:
+            entry = (traces, dict(targets))
+            # panels may have been written before getting here
+            for index, (sequence, write, when) in self._sent.items():
+                self._check(entry, index, sequence, write, when)
+            if entry[1]:
+                self._in_flight.append(entry)
+
+    def sent(self, index, sequence, write):
+        """
+        A push was written to a panel, for PanelOutput.on_sent
+        """
+        now = time.perf_counter()
+        with self._lock:
+            self._sent[index] = (sequence, write, now)
+            for entry in self._in_flight:
+                self._check(entry, index, sequence, write, now)
+            self._in_flight = [entry for entry in self._in_flight if entry[1]]
+
+    def _check(self, entry, index, sequence, write, when):
+        traces, targets = entry
+        if index not in targets or targets[index] > sequence:
+            return
+        del targets[index]
+        for trace in traces:
+            trace.writes[index] = write
+        if targets:
+            return
+
+        for trace in traces:
+            trace.pushed = when
+            if trace.name not in self.render:
+                self.render[trace.name] = RollingHistogram(self.window)
+                self.photon[trace.name] = RollingHistogram(self.window)
+            self.render[trace.name].record((trace.rendered - trace.received) * 1000)
+            self.photon[trace.name].record((trace.pushed - trace.received) * 1000)
+            self.traces.append(trace)
+
+    def summary(self):
+        """
+        Latency percentiles of each command, in milliseconds
+        """
+        with self._lock:
+            return {
+                "unchanged": self.unchanged,
+                "commands": {
+                    name: {
+                        "render": self.render[name].summary(),
+                        "photon": self.photon[name].summary(),
+                    }
+                    for name in sorted(self.render)
+                },
+            }
+
+    def save(self, path):
+        """
+        Save the kept traces in the Chrome trace event format
+        """
+
+        def timestamp(value):
+            return round((value - self._start) * 1_000_000, 1)
+
+        with self._lock:
+            traces = list(self.traces)
+
+        events = []
+        for number, trace in enumerate(traces):
+            event = {"cat": "command", "name": trace.name, "id": number, "pid": 0}
+            events.append({**event, "ph": "b", "ts": timestamp(trace.received)})
+            events.append(
+                {
+                    **event,
+                    "ph": "n",
+                    "ts": timestamp(trace.rendered),
+                    "name": "rendered",
+                }
+            )
+            events.append(
+                {
+                    **event,
+                    "ph": "e",
+                    "ts": timestamp(trace.pushed),
+                    "args": {
+                        "render_ms": (trace.rendered - trace.received) * 1000,
+                        "photon_ms": (trace.pushed - trace.received) * 1000,
+                        "writes": {
+                            f"display_{index}": write
+                            for index, write in sorted(trace.writes.items())
+                        },
+                    },
+                }
+            )
+
+        with open(path, "w", encoding="UTF-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        return len(traces)
@@ -1,55 +1,52 @@
+import collections
 import enum
-from PIL import ImageColor
+import threading
+from PIL import Image, ImageColor
 
 import json
+import numpy as np
 import serial
 
 
 def shift_hue(image, hue):
-    image_hsv = image.convert("HSV")
-
-    image_hue_shifted = image_hsv.copy()
-    pixels = image_hue_shifted.load()
-    width, height = image_hue_shifted.size
-    for x in range(width):
-        for y in range(height):
-            h, s, v = pixels[x, y]
-            h = (h + hue) % 256
-            pixels[x, y] = (h, s, v)
+    """
+    Rotate the hue of an image
+    Works on the whole H plane at once
+    """
+    image_hsv = np.array(image.convert("HSV"))
+    image_hsv[..., 0] = (image_hsv[..., 0].astype(np.int32) + hue) % 256
 
     # Convert the image back to RGB
-    return image_hue_shifted.convert("RGB")
+    return Image.fromarray(image_hsv, "HSV").convert("RGB")
 
 
 def color_shift(image, hex_color):
-    target_rgb = ImageColor.getrgb(hex_color)
-    red, green, blue = target_rgb
-
-    # Iterate over each pixel and shift the red channel
-    pixels = image.load()
-    width, height = image.size
-    for x in range(width):
-        for y in range(height):
-            _, _, _, alpha = pixels[x, y]
-            pixels[x, y] = (red, green, blue, alpha)
+    """
+    Replace the color of every pixel, keeping the alpha channel
+    """
+    pixels = np.array(image.convert("RGBA"))
+    pixels[..., :3] = ImageColor.getrgb(hex_color)[:3]
 
-    return image
+    return Image.fromarray(pixels, "RGBA")
 
 
 def blend_colors(color1, color2, weight):
+    """
+    Blend two hex colors
+    If weight is a sequence, a list of colors is returned for each weight
+    """
     # Convert hex colors to RGB
-    rgb1 = tuple(int(color1.strip("#")[i : i + 2], 16) for i in (0, 2, 4))
-    rgb2 = tuple(int(color2.strip("#")[i : i + 2], 16) for i in (0, 2, 4))
+    rgb1 = np.array([int(color1.strip("#")[i : i + 2], 16) for i in (0, 2, 4)])
+    rgb2 = np.array([int(color2.strip("#")[i : i + 2], 16) for i in (0, 2, 4)])
 
-    # Calculate the blended RGB values
-    blended_rgb = tuple(
-        int((1 - weight) * c1 + weight * c2) for c1, c2 in zip(rgb1, rgb2)
-    )
+    # Calculate the blended RGB values, truncated like int()
+    weights = np.asarray(weight, dtype=np.float64)[..., np.newaxis]
+    blended_rgb = ((1 - weights) * rgb1 + weights * rgb2).astype(np.int64)
 
     # Convert RGB to hex color
-    blended_hex = "#{:02x}{:02x}{:02x}".format(*blended_rgb)
-
-    return blended_hex
+    if blended_rgb.ndim == 1:
+        return "#{:02x}{:02x}{:02x}".format(*blended_rgb)
+    return ["#{:02x}{:02x}{:02x}".format(*rgb) for rgb in blended_rgb]
 
 
 def map_range(x, in_min, in_max, out_min, out_max):
@@ -63,14 +60,26 @@ def clamp(val, minn, maxn):
     return max(min(maxn, val), minn)
 
 
-def send_data(data: dict, ser: serial.Serial, prefix: str = ""):
+def flatten_data(data: dict, prefix: str = ""):
+    """
+    Flatten nested settings into (dotted key, value) pairs
+    """
     for key, value in data.items():
         if isinstance(value, dict):
-            send_data(value, ser, prefix=f"{prefix}{key}.")
+            yield from flatten_data(value, prefix=f"{prefix}{key}.")
         else:
-            serialized_value = json.dumps(value)
-            data = f"{prefix}{key}={serialized_value}\n"
-            ser.write(data.encode())
+            yield f"{prefix}{key}", value
+
+
+def send_data(data: dict, ser: serial.Serial, prefix: str = ""):
+    """
+    Send nested settings as key=value lines, in a single write
+    """
+    ser.write(
+        "".join(
+            f"{key}={json.dumps(value)}\n" for key, value in flatten_data(data, prefix)
+        ).encode()
+    )
 
 
 def cubic_in_out(t):
@@ -126,3 +135,50 @@ class ExtendedIntEnum(enum.IntEnum):
         Return list of enumerations
         """
         return list(map(lambda c: c.value, cls))
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache
+    Keys are tuples, the first item is used as a group for invalidation
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, factory=None):
+        """
+        Return a cached value, create it with factory() on a miss
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        if factory is None:
+            return None
+
+        value = factory()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def invalidate(self, group=None):
+        """
+        Remove all items in a group, or everything if no group is given
+        """
+        with self._lock:
+            if group is None:
+                self._items.clear()
+                return
+
+            for key in [key for key in self._items if key[0] == group]:
+                del self._items[key]
@@ -0,0 +1,269 @@
+"""
+Render worker process for Kevinbot v3 Eyes
+Author: Kevin Ahr
+
+Skins are rendered in a separate process, so heavy frames don't hold the
+GIL while the main process handles serial and SPI output.
+Finished frames are written to a ring of shared memory framebuffers in
+panel format. Only small messages go over the pipe: settings when they
+change, and the page and position of each eye to render.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import atlas as sprite_atlas
+import display
+import skins
+import utils
+
+
+class SharedFramePool(display.FramePool):
+    """
+    Fixed set of frames in shared memory
+
+    Unlike FramePool, it never grows, acquire() returns None when every
+    frame is in use.
+    """
+
+    def __init__(self, shape, buffer, slots):
+        super().__init__(shape)
+        size = shape[0] * shape[1] * 2
+        self.frames = [
+            display.Frame(self, np.ndarray(shape, ">u2", buffer, slot * size))
+            for slot in range(slots)
+        ]
+        self.free = list(self.frames)
+
+    def acquire(self) -> display.Frame:
+        with self.lock:
+            if not self.free:
+                return None
+            frame = self.free.pop()
+        frame.retain()
+        return frame
+
+
+class RenderWorker:
+    """
+    Main process side of the render worker
+
+    render() sends a request and returns a future of the pushes, which is
+    resolved by the event loop when the worker replies.
+    """
+
+    def __init__(self, shape, size, rotation, slots=4):
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=slots * shape[0] * shape[1] * 2
+        )
+        self.pool = SharedFramePool(shape, self.memory.buf, slots)
+        self.alive = True
+        self.busy = 0
+        self.version = None
+
+        context = multiprocessing.get_context("spawn")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(child, self.memory.name, shape, slots, size, rotation),
+            name="render-worker",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+        self._loop = None
+        self._requests = {}
+        self._next_request = 0
+        # Frames currently on the panels, released once newer ones arrive
+        self._shown = []
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """
+        Receive replies on an event loop
+        """
+        self._loop = loop
+        loop.add_reader(self.connection.fileno(), self._receive)
+
+    def render(self, settings, version, views, step, key):
+        """
+        Render the eyes, views has the (page, pos) of each eye
+        Settings are only sent when their version changes
+        Returns a future of the list of (frame, box, key, panels) to push
+        Positions are quantized to step and frames cached when step is set
+        """
+        future = self._loop.create_future()
+
+        # one frame for each distinct view
+        distinct = list(dict.fromkeys(views))
+        frames = [self.pool.acquire() for _ in distinct]
+        if None in frames:
+            # all frames still on their way to the panels
+            for frame in frames:
+                if frame is not None:
+                    frame.release()
+            self.busy += 1
+            future.set_result([])
+            return future
+
+        request = self._next_request
+        self._next_request += 1
+        self._requests[request] = (future, views, distinct, frames, key)
+        try:
+            if version != self.version:
+                self.connection.send(("settings", settings))
+                self.version = version
+            self.connection.send(
+                (
+                    "render",
+                    request,
+                    [
+                        (int(page), pos, self.pool.frames.index(frame))
+                        for (page, pos), frame in zip(distinct, frames)
+                    ],
+                    step,
+                )
+            )
+        except (BrokenPipeError, OSError):
+            logging.error("Render worker stopped, rendering in the main process")
+            self.stop()
+        return future
+
+    def _receive(self):
+        try:
+            _, request, boxes = self.connection.recv()
+        except (EOFError, OSError):
+            logging.error("Render worker stopped, rendering in the main process")
+            self.stop()
+            return
+
+        future, views, distinct, frames, key = self._requests.pop(request)
+
+        for frame in self._shown:
+            frame.release()
+        self._shown = frames
+
+        if len(distinct) == 1:
+            future.set_result([(frames[0], boxes[0], key, None)])
+            return
+
+        future.set_result(
+            [
+                (
+                    frames[distinct.index(view)],
+                    boxes[distinct.index(view)],
+                    key,
+                    (index,),
+                )
+                for index, view in enumerate(views)
+            ]
+        )
+
+    def stop(self):
+        """
+        Stop the worker, anything still waiting gets no frames
+        """
+        if not self.alive:
+            return
+        self.alive = False
+
+        if self._loop is not None:
+            self._loop.remove_reader(self.connection.fileno())
+        for future, _, _, frames, _ in self._requests.values():
+            for frame in frames:
+                frame.release()
+            if not future.done():
+                future.set_result([])
+        self._requests = {}
+
+        try:
+            self.connection.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+        # frames may still point into it, the mapping goes away with the process
+        self.memory.unlink()
+
+
+def worker_main(connection, name, shape, slots, size, rotation):
+    """
+    Render worker process
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    frames = np.ndarray((slots, *shape), ">u2", memory.buf)
+
+    styles = {
+        1: skins.eye_simple_style,
+        2: skins.eye_metallic_style,
+        3: skins.eye_neon_style,
+    }
+    settings = None
+    frame_cache = utils.LRUCache(1)
+    atlas = None
+    atlas_options = None
+
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        if message[0] == "stop":
+            return
+
+        if message[0] == "settings":
+            settings = message[1]
+            skins.sprite_cache.maxsize = settings["cache"]["sprites"]
+            frame_cache.maxsize = (
+                settings["cache"]["frames"]["memory_mb"]
+                * 1024
+                * 1024
+                // (shape[0] * shape[1] * 2)
+            )
+            frame_cache.invalidate()
+
+            if (
+                settings["atlas"]["enabled"]
+                and settings["display"]["native_compositing"]
+                and atlas is None
+            ):
+                atlas = sprite_atlas.SpriteAtlas(settings["atlas"]["path"])
+                skins.atlas = atlas
+            # only rebuilt when the options the sprites depend on change
+            if atlas is not None:
+                options = sprite_atlas.atlas_options(settings["skins"])
+                if options != atlas_options:
+                    atlas_options = options
+                    atlas.refresh_in_background(settings)
+            continue
+
+        _, request, jobs, step = message
+        native = settings["display"]["native_compositing"]
+        boxes = []
+        for page, pos, slot in jobs:
+            style = styles[page]
+            if step is None:
+                image, box = style(settings, pos, size, native)
+                display.to_panel(image, rotation, frames[slot])
+            else:
+                pos = (round(pos[0] / step) * step, round(pos[1] / step) * step)
+
+                def create():
+                    image, box = style(settings, pos, size, native)
+                    return (
+                        display.to_panel(image, rotation, np.empty(shape, ">u2")),
+                        box,
+                    )
+
+                data, box = frame_cache.get((page, *pos), create)
+                frames[slot] = data
+            boxes.append(box)
+
+        connection.send(("done", request, boxes))